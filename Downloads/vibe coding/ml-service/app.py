@@ -3,23 +3,28 @@ Aircraft Defect Detection ML Service
 Flask application for ML inference using YOLOv8 and GPT Vision API
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
 import os
+import gzip
+import orjson
 from datetime import datetime
 import time
+import atexit
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Import utilities
 from utils.config import Config
 from utils.logger import setup_logger, log_request, log_response, log_error
+from utils.result_cache import ResultCache
+from utils.buffer_pool import BufferPool
 
 # Import services
 from services.image_preprocessor import ImagePreprocessor
 from services.yolo_detector import YOLODetector
 from services.gpt_vision_client import GPTVisionClient
 from services.ensemble_aggregator import EnsembleAggregator
+from services.inference_worker import InferenceWorker
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -28,45 +33,89 @@ CORS(app)
 # Load configuration
 app.config.from_object(Config)
 
+# Static readiness inputs, resolved once instead of on every probe
+_YOLO_MODEL_DIR = os.path.dirname(Config.YOLO_MODEL_PATH)
+_API_KEY_CONFIGURED = bool(Config.OPENAI_API_KEY)
+
+# Filesystem readiness checks are reused for a few seconds between probes
+_READY_CACHE_TTL = 5.0
+_ready_cache = {'ts': 0.0, 'checks': None}
+_ready_cache_lock = threading.Lock()
+
 # Set up logging
 logger = setup_logger('ml-service')
 
-# Initialize services (lazy loading)
+# Service instances, created by init_services() at worker start or first request
 image_preprocessor = None
 yolo_detector = None
 gpt_vision_client = None
 ensemble_aggregator = None
+inference_worker = None
 
+# Detection results keyed on image URL + model fingerprint
+result_cache = ResultCache(maxsize=Config.RESULT_CACHE_SIZE, ttl=Config.RESULT_CACHE_TTL)
 
-def get_services():
+
+_services_lock = threading.Lock()
+
+
+def init_services():
     """
-    Initialize and return service instances (lazy loading)
+    Initialize service instances once per process
     
-    Returns:
-        tuple: (preprocessor, yolo, gpt, ensemble)
+    Called from the Gunicorn post_worker_init hook and on direct startup so
+    the YOLO model and clients are warm before the first request arrives,
+    and from get_services() for any other entry point. Safe to call more
+    than once.
     """
-    global image_preprocessor, yolo_detector, gpt_vision_client, ensemble_aggregator
+    global image_preprocessor, yolo_detector, gpt_vision_client, ensemble_aggregator, inference_worker
     
-    if image_preprocessor is None:
+    with _services_lock:
+        if ensemble_aggregator is not None:
+            return
+        
         logger.info("Initializing services...")
         
         # Initialize image preprocessor
         image_preprocessor = ImagePreprocessor(
             target_size=640,
             min_size=Config.MIN_IMAGE_SIZE,
-            max_size=Config.MAX_IMAGE_SIZE
+            max_size=Config.MAX_IMAGE_SIZE,
+            buffer_pool=BufferPool((640, 640, 3), size=Config.PREPROCESS_BUFFER_POOL_SIZE),
+            http_pool_size=Config.INFERENCE_POOL_WORKERS,
+            max_download_bytes=Config.MAX_IMAGE_BYTES,
+            gpt_passthrough_max_bytes=Config.GPT_PASSTHROUGH_MAX_BYTES
         )
         
-        # Initialize YOLO detector
+        # Initialize YOLO detector and load weights up front
         yolo_detector = YOLODetector(
             model_path=Config.YOLO_MODEL_PATH,
-            confidence_threshold=Config.YOLO_CONFIDENCE_THRESHOLD
+            confidence_threshold=Config.YOLO_CONFIDENCE_THRESHOLD,
+            precision=Config.YOLO_PRECISION,
+            engine_path=Config.YOLO_ENGINE_PATH,
+            torch_compile=Config.YOLO_TORCH_COMPILE
         )
+        try:
+            yolo_detector.load_model()
+            yolo_detector.warmup(batch_size=Config.YOLO_MAX_BATCH_SIZE)
+        except Exception as e:
+            # Keep serving; the detector retries the load on first inference
+            log_error(logger, e, 'YOLO model preload failed')
+        
+        # Start the single YOLO inference thread
+        inference_worker = InferenceWorker(
+            yolo_detector,
+            max_batch_size=Config.YOLO_MAX_BATCH_SIZE,
+            max_wait_ms=Config.YOLO_BATCH_WAIT_MS
+        )
+        inference_worker.start()
+        atexit.register(inference_worker.stop, timeout=5)
         
         # Initialize GPT Vision client
         gpt_vision_client = GPTVisionClient(
             api_key=Config.OPENAI_API_KEY,
-            model=Config.GPT_VISION_MODEL
+            model=Config.GPT_VISION_MODEL,
+            max_concurrency=Config.INFERENCE_POOL_WORKERS
         )
         
         # Initialize ensemble aggregator
@@ -74,11 +123,50 @@ def get_services():
             yolo_weight=Config.ENSEMBLE_YOLO_WEIGHT,
             gpt_weight=Config.ENSEMBLE_GPT_WEIGHT
         )
+        ensemble_aggregator.warmup()
         
         logger.info("Services initialized successfully")
+
+
+def get_services():
+    """
+    Return service instances, initializing them on first use
+    
+    Gunicorn and direct startup preload the services; other entry points
+    (flask run, other WSGI servers) initialize them on the first request.
+    
+    Returns:
+        tuple: (preprocessor, yolo, gpt, ensemble)
+    """
+    if ensemble_aggregator is None:
+        init_services()
     
     return image_preprocessor, yolo_detector, gpt_vision_client, ensemble_aggregator
 
+
+def get_model_fingerprint():
+    """
+    Identify the current model configuration for result caching
+    
+    The YOLO weights mtime is included so replacing the model file
+    invalidates previously cached results.
+    
+    Returns:
+        str: Fingerprint of YOLO weights, GPT model and ensemble weights
+    """
+    model_path = Config.YOLO_MODEL_PATH
+    if Config.YOLO_ENGINE_PATH and os.path.exists(Config.YOLO_ENGINE_PATH):
+        model_path = Config.YOLO_ENGINE_PATH
+    
+    try:
+        model_mtime = os.path.getmtime(model_path)
+    except OSError:
+        model_mtime = 0
+    
+    return (f"{model_path}:{model_mtime}:{Config.GPT_VISION_MODEL}:"
+            f"{Config.YOLO_CONFIDENCE_THRESHOLD}:{Config.ENSEMBLE_YOLO_WEIGHT}:{Config.ENSEMBLE_GPT_WEIGHT}:"
+            f"{Config.GPT_CASCADE_MIN_DETECTIONS}:{Config.GPT_CASCADE_CONFIDENCE}")
+
 # Health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -98,7 +186,34 @@ def health_check():
     }
     
     log_response(logger, '/health', 200)
-    return jsonify(response), 200
+    return json_response(response, 200)
+
+def _get_readiness_checks():
+    """
+    Run the readiness checks, reusing the last result within _READY_CACHE_TTL
+    
+    Returns:
+        dict: Check name -> bool
+    """
+    with _ready_cache_lock:
+        now = time.monotonic()
+        if _ready_cache['checks'] is not None and now - _ready_cache['ts'] < _READY_CACHE_TTL:
+            return _ready_cache['checks']
+        
+        # Check if model path exists (directory should exist even if model file doesn't yet)
+        model_dir_exists = os.path.exists(_YOLO_MODEL_DIR) if _YOLO_MODEL_DIR else True
+        model_file_exists = os.path.exists(Config.YOLO_MODEL_PATH)
+        
+        checks = {
+            'model_directory_exists': model_dir_exists,
+            'model_file_exists': model_file_exists,
+            'api_configured': _API_KEY_CONFIGURED
+        }
+        
+        _ready_cache['ts'] = now
+        _ready_cache['checks'] = checks
+        return checks
+
 
 @app.route('/ready', methods=['GET'])
 def readiness_check():
@@ -111,76 +226,245 @@ def readiness_check():
     log_request(logger, '/ready', 'GET')
     
     try:
-        # Check if model path exists (directory should exist even if model file doesn't yet)
-        model_dir_exists = os.path.exists(os.path.dirname(app.config['YOLO_MODEL_PATH'])) if os.path.dirname(app.config['YOLO_MODEL_PATH']) else True
-        model_file_exists = os.path.exists(app.config['YOLO_MODEL_PATH'])
-        
-        # Check if OpenAI API key is configured
-        api_key_configured = bool(app.config['OPENAI_API_KEY'])
+        checks = _get_readiness_checks()
         
         # Service is ready if API key is configured (model can be loaded later)
-        is_ready = api_key_configured
+        is_ready = checks['api_configured']
         status_code = 200 if is_ready else 503
         
         response = {
             'status': 'ready' if is_ready else 'not_ready',
-            'checks': {
-                'model_directory_exists': model_dir_exists,
-                'model_file_exists': model_file_exists,
-                'api_configured': api_key_configured
-            },
+            'checks': checks,
             'timestamp': datetime.utcnow().isoformat()
         }
         
         log_response(logger, '/ready', status_code)
-        return jsonify(response), status_code
+        return json_response(response, status_code)
         
     except Exception as e:
         log_error(logger, e, 'Readiness check failed')
-        return jsonify({
+        return json_response({
             'status': 'error',
             'message': str(e),
             'timestamp': datetime.utcnow().isoformat()
-        }), 503
+        }, 503)
+
+@app.after_request
+def compress_response(response):
+    """Gzip JSON bodies for clients that accept it"""
+    if (Config.RESPONSE_GZIP_LEVEL <= 0
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers
+            or request.accept_encodings['gzip'] <= 0):
+        return response
+    
+    body = response.get_data()
+    if len(body) < Config.RESPONSE_GZIP_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(body, compresslevel=Config.RESPONSE_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 # Error handlers
 @app.errorhandler(400)
 def bad_request(error):
     """Handle bad request errors"""
     log_error(logger, error, 'Bad request')
-    return jsonify({
+    return json_response({
         'success': False,
         'error': {
             'code': 'BAD_REQUEST',
             'message': str(error),
             'timestamp': datetime.utcnow().isoformat()
         }
-    }), 400
+    }, 400)
 
 @app.errorhandler(404)
 def not_found(error):
     """Handle not found errors"""
-    return jsonify({
+    return json_response({
         'success': False,
         'error': {
             'code': 'NOT_FOUND',
             'message': 'Endpoint not found',
             'timestamp': datetime.utcnow().isoformat()
         }
-    }), 404
+    }, 404)
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle internal server errors"""
     log_error(logger, error, 'Internal server error')
-    return jsonify({
+    return json_response({
         'success': False,
         'error': {
             'code': 'INTERNAL_ERROR',
             'message': 'An internal error occurred',
             'timestamp': datetime.utcnow().isoformat()
         }
-    }), 500
+    }, 500)
+
+
+def json_response(obj, status=200):
+    """
+    Serialize a response body with orjson
+    
+    Args:
+        obj: JSON-serializable object (NumPy scalars and arrays allowed)
+        status: HTTP status code
+        
+    Returns:
+        flask.Response: application/json response
+    """
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+def _dumps_line(obj):
+    """Serialize one newline-delimited JSON record"""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+
+
+def _ndjson_response(lines):
+    """
+    Wrap an iterable of JSON lines in a streaming response
+    
+    Args:
+        lines: Iterable of newline-terminated JSON records
+        
+    Returns:
+        flask.Response: Chunked application/x-ndjson response
+    """
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+def _detection_stages(future_yolo, future_gpt, run_gpt, ensemble, cache_key,
+                      inspection_id, quality_score, original_dimensions, start_time):
+    """
+    Collect inference results and aggregate them, one stage at a time
+    
+    When future_gpt is None the GPT call is deferred until YOLO finishes and
+    skipped if YOLO already found enough high-confidence defects.
+    
+    Yields:
+        tuple: ('yolo', YOLO detections) as soon as YOLO finishes, then
+               ('final', response body) once GPT and the ensemble are done
+    """
+    inference_failed = False
+    
+    yolo_results = []
+    try:
+        yolo_results = future_yolo.result(timeout=60)
+    except Exception as e:
+        logger.error(f"YOLO detection failed: {str(e)}")
+        inference_failed = True
+    
+    yield 'yolo', yolo_results
+    
+    if future_gpt is not None:
+        gpt_results = future_gpt.result()
+    elif _yolo_is_conclusive(yolo_results):
+        logger.info("YOLO results conclusive, skipping GPT Vision analysis")
+        gpt_results = []
+    else:
+        gpt_results = run_gpt()
+    
+    if gpt_results is None:
+        gpt_results = []
+        inference_failed = True
+    
+    logger.info(f"Parallel inference complete: YOLO={len(yolo_results)}, GPT={len(gpt_results)}")
+    
+    # Step 3: Ensemble aggregation
+    logger.info("Step 3: Aggregating results...")
+    final_detections = ensemble.aggregate(yolo_results, gpt_results)
+    
+    logger.info(f"Ensemble aggregation complete: {len(final_detections)} final detection(s)")
+    
+    # Calculate processing time
+    processing_time = time.time() - start_time
+    
+    # Prepare response
+    response_data = {
+        'success': True,
+        'data': {
+            'defects': final_detections,
+            'processingTime': round(processing_time, 2),
+            'qualityScore': round(quality_score, 2),
+            'metadata': {
+                'inspectionId': inspection_id,
+                'yoloDetections': len(yolo_results),
+                'gptDetections': len(gpt_results),
+                'finalDetections': len(final_detections),
+                'originalDimensions': {
+                    'width': original_dimensions[0],
+                    'height': original_dimensions[1]
+                }
+            }
+        }
+    }
+    
+    # Partial results from a failed model are not worth repeating
+    if not inference_failed:
+        result_cache.set(cache_key, response_data['data'])
+    
+    log_response(logger, '/ml/detect', 200, processing_time)
+    logger.info(f"Detection complete: {len(final_detections)} defect(s) found in {processing_time:.2f}s")
+    
+    yield 'final', response_data
+
+
+def _yolo_is_conclusive(yolo_results):
+    """
+    Check whether YOLO alone is confident enough to skip GPT Vision
+    
+    Args:
+        yolo_results: YOLO detections
+        
+    Returns:
+        bool: True if the confidence cascade allows skipping GPT
+    """
+    confident = sum(1 for det in yolo_results if det['confidence'] > Config.GPT_CASCADE_CONFIDENCE)
+    return confident >= Config.GPT_CASCADE_MIN_DETECTIONS
+
+
+def _stream_stages(stages):
+    """
+    Serialize detection stages as newline-delimited JSON
+    
+    Args:
+        stages: Generator from _detection_stages
+        
+    Yields:
+        str: One JSON object per line
+    """
+    try:
+        for stage, payload in stages:
+            if stage == 'yolo':
+                defects = [dict(det, source='yolo') for det in payload]
+                yield _dumps_line({'stage': 'yolo', 'defects': defects})
+            else:
+                yield _dumps_line({'stage': 'final', **payload})
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        log_error(logger, e, 'ML processing error')
+        yield _dumps_line({
+            'stage': 'final',
+            'success': False,
+            'error': {
+                'code': 'ML_ERROR',
+                'message': 'ML processing failed',
+                'details': str(e),
+                'timestamp': datetime.utcnow().isoformat()
+            }
+        })
 
 
 @app.route('/ml/detect', methods=['POST'])
@@ -191,7 +475,8 @@ def detect_defects():
     Request Body:
         {
             "imageUrl": "https://s3.amazonaws.com/...",
-            "inspectionId": "inspection_id_123"
+            "inspectionId": "inspection_id_123",
+            "stream": false
         }
     
     Response:
@@ -216,6 +501,10 @@ def detect_defects():
                 }
             }
         }
+    
+    With "stream": true the response is application/x-ndjson: a
+    {"stage": "yolo", "defects": [...]} line as soon as YOLO finishes,
+    followed by the response above with "stage": "final" added.
     """
     start_time = time.time()
     
@@ -224,37 +513,56 @@ def detect_defects():
         
         # Validate request
         if not request.json:
-            return jsonify({
+            return json_response({
                 'success': False,
                 'error': {
                     'code': 'INVALID_REQUEST',
                     'message': 'Request body must be JSON',
                     'timestamp': datetime.utcnow().isoformat()
                 }
-            }), 400
+            }, 400)
         
         # Extract parameters
         image_url = request.json.get('imageUrl')
         inspection_id = request.json.get('inspectionId')
+        stream = bool(request.json.get('stream', False))
         
         if not image_url:
-            return jsonify({
+            return json_response({
                 'success': False,
                 'error': {
                     'code': 'MISSING_PARAMETER',
                     'message': 'imageUrl is required',
                     'timestamp': datetime.utcnow().isoformat()
                 }
-            }), 400
+            }, 400)
         
         logger.info(f"Processing detection request: inspectionId={inspection_id}, imageUrl={image_url[:50]}...")
         
+        # Repeat requests for the same image skip preprocessing and inference
+        cache_key = ResultCache.make_key(image_url, get_model_fingerprint())
+        cached_data = result_cache.get(cache_key)
+        if cached_data is not None:
+            processing_time = time.time() - start_time
+            data = dict(cached_data)
+            data['processingTime'] = round(processing_time, 2)
+            data['metadata'] = dict(cached_data['metadata'], inspectionId=inspection_id, cached=True)
+            
+            log_response(logger, '/ml/detect', 200, processing_time)
+            logger.info(f"Detection served from cache: {len(data['defects'])} defect(s)")
+            
+            if stream:
+                return _ndjson_response([_dumps_line({'stage': 'final', 'success': True, 'data': data})])
+            return json_response({'success': True, 'data': data}, 200)
+        
         # Get service instances
         preprocessor, yolo, gpt, ensemble = get_services()
         
         # Step 1: Preprocess image
         logger.info("Step 1: Preprocessing image...")
-        preprocess_result = preprocessor.preprocess(image_url)
+        # Without the cascade GPT always runs, so encode its payload up front
+        cascade = Config.GPT_CASCADE_MIN_DETECTIONS > 0
+        preprocess_result = preprocessor.preprocess(image_url, include_gpt_payload=not cascade)
         
         original_image = preprocess_result['original']
         processed_image = preprocess_result['processed']
@@ -266,90 +574,62 @@ def detect_defects():
         # Step 2: Parallel inference (YOLO + GPT Vision)
         logger.info("Step 2: Running parallel inference (YOLO + GPT Vision)...")
         
-        yolo_results = []
-        gpt_results = []
+        # YOLO runs on the dedicated inference thread, GPT on the shared event loop
+        future_yolo = inference_worker.submit(processed_image, original_dimensions)
         
-        def run_yolo():
-            """Run YOLO detection"""
-            try:
-                return yolo.detect_and_process(processed_image, original_dimensions)
-            except Exception as e:
-                logger.error(f"YOLO detection failed: {str(e)}")
-                return []
+        # Recycle the YOLO input buffer once the inference thread is done with it
+        # (not when the request stops waiting, which may be earlier on timeout)
+        future_yolo.add_done_callback(lambda _: preprocessor.release_buffer(processed_image))
         
         def run_gpt():
             """Run GPT Vision analysis"""
             try:
-                return gpt.analyze_with_timeout(original_image, timeout=30)
+                return gpt.analyze_sync(original_image, timeout=30)
             except Exception as e:
                 logger.error(f"GPT Vision analysis failed: {str(e)}")
-                return []
-        
-        # Execute in parallel using ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_yolo = executor.submit(run_yolo)
-            future_gpt = executor.submit(run_gpt)
-            
-            # Wait for both to complete
-            yolo_results = future_yolo.result()
-            gpt_results = future_gpt.result()
-        
-        logger.info(f"Parallel inference complete: YOLO={len(yolo_results)}, GPT={len(gpt_results)}")
-        
-        # Step 3: Ensemble aggregation
-        logger.info("Step 3: Aggregating results...")
-        final_detections = ensemble.aggregate(yolo_results, gpt_results)
-        
-        logger.info(f"Ensemble aggregation complete: {len(final_detections)} final detection(s)")
-        
-        # Calculate processing time
-        processing_time = time.time() - start_time
+                return None
+        
+        # With the confidence cascade enabled GPT waits for YOLO's verdict
+        if cascade:
+            future_gpt = None
+        else:
+            future_gpt = gpt.submit(original_image, timeout=30,
+                                    base64_image=preprocess_result['gpt_payload'])
+        
+        stages = _detection_stages(
+            future_yolo, future_gpt, run_gpt, ensemble, cache_key,
+            inspection_id, quality_score, original_dimensions, start_time
+        )
         
-        # Prepare response
-        response_data = {
-            'success': True,
-            'data': {
-                'defects': final_detections,
-                'processingTime': round(processing_time, 2),
-                'qualityScore': round(quality_score, 2),
-                'metadata': {
-                    'inspectionId': inspection_id,
-                    'yoloDetections': len(yolo_results),
-                    'gptDetections': len(gpt_results),
-                    'finalDetections': len(final_detections),
-                    'originalDimensions': {
-                        'width': original_dimensions[0],
-                        'height': original_dimensions[1]
-                    }
-                }
-            }
-        }
+        if stream:
+            return _ndjson_response(_stream_stages(stages))
         
-        log_response(logger, '/ml/detect', 200, processing_time)
-        logger.info(f"Detection complete: {len(final_detections)} defect(s) found in {processing_time:.2f}s")
+        for stage, payload in stages:
+            if stage == 'final':
+                response_data = payload
         
-        return jsonify(response_data), 200
+        return json_response(response_data, 200)
         
     except ValueError as e:
         # Validation or preprocessing errors
         processing_time = time.time() - start_time
         log_error(logger, e, 'Validation error')
         
-        return jsonify({
+        return json_response({
             'success': False,
             'error': {
                 'code': 'VALIDATION_ERROR',
                 'message': str(e),
                 'timestamp': datetime.utcnow().isoformat()
             }
-        }), 400
+        }, 400)
         
     except Exception as e:
         # Unexpected errors
         processing_time = time.time() - start_time
         log_error(logger, e, 'ML processing error')
         
-        return jsonify({
+        return json_response({
             'success': False,
             'error': {
                 'code': 'ML_ERROR',
@@ -357,7 +637,7 @@ def detect_defects():
                 'details': str(e),
                 'timestamp': datetime.utcnow().isoformat()
             }
-        }), 500
+        }, 500)
 
 if __name__ == '__main__':
     # Log startup information
@@ -383,6 +663,9 @@ if __name__ == '__main__':
     logger.info(f"  Ensemble Weights: YOLO={config_summary['ensemble_weights']['yolo']}, GPT={config_summary['ensemble_weights']['gpt']}")
     logger.info(f"  Image Size Range: {config_summary['image_size_range']['min']}x{config_summary['image_size_range']['min']} to {config_summary['image_size_range']['max']}x{config_summary['image_size_range']['max']}")
     
+    # Load models before accepting traffic
+    init_services()
+    
     logger.info("=" * 60)
     logger.info(f"Service starting on http://0.0.0.0:{Config.ML_SERVICE_PORT}")
     logger.info("=" * 60)
@@ -0,0 +1,90 @@
+"""
+YOLOv8 Model Export Script
+Exports trained weights to an optimized inference engine (TensorRT / ONNX / OpenVINO)
+"""
+
+import os
+import sys
+import argparse
+
+from ultralytics import YOLO
+
+from utils.logger import setup_logger
+
+logger = setup_logger('model-export')
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Export YOLOv8 weights for optimized inference')
+    
+    parser.add_argument('--weights', type=str, required=True,
+                        help='Path to trained .pt weights')
+    parser.add_argument('--format', type=str, default='engine', choices=['engine', 'onnx', 'openvino'],
+                        help='Export format: engine (TensorRT GPU), onnx, or openvino (CPU) (default: engine)')
+    parser.add_argument('--int8', action='store_true',
+                        help='INT8 quantization with calibration on --data (TensorRT, OpenVINO)')
+    parser.add_argument('--half', action='store_true',
+                        help='FP16 export (ignored when --int8 is set)')
+    parser.add_argument('--data', type=str, default=None,
+                        help='dataset.yaml used for INT8 calibration (e.g. from train_model.py)')
+    parser.add_argument('--image-size', type=int, default=640,
+                        help='Input image size (default: 640)')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='Maximum batch size, should match YOLO_MAX_BATCH_SIZE (default: 8)')
+    parser.add_argument('--device', type=str, default='0',
+                        help='Export device; TensorRT requires a CUDA GPU, use cpu for openvino (default: 0)')
+    
+    return parser.parse_args()
+
+
+def main():
+    """Main export workflow"""
+    try:
+        args = parse_arguments()
+        
+        if not os.path.exists(args.weights):
+            raise ValueError(f"Weights not found: {args.weights}")
+        
+        if args.int8 and not args.data:
+            raise ValueError("--int8 requires --data for calibration images")
+        
+        if args.int8 and args.format == 'onnx':
+            raise ValueError("--int8 is not supported for onnx; use --format openvino for CPU INT8")
+        
+        logger.info("=" * 60)
+        logger.info("YOLOv8 Aircraft Defect Detection - Model Export")
+        logger.info("=" * 60)
+        logger.info(f"Weights: {args.weights}")
+        logger.info(f"Format: {args.format}, int8={args.int8}, half={args.half and not args.int8}")
+        
+        model = YOLO(args.weights)
+        
+        # Dynamic batch so the engine serves micro-batches from the inference worker
+        export_path = model.export(
+            format=args.format,
+            imgsz=args.image_size,
+            batch=args.batch_size,
+            dynamic=True,
+            int8=args.int8,
+            half=args.half and not args.int8,
+            data=args.data,
+            device=args.device
+        )
+        
+        logger.info("=" * 60)
+        logger.info(f"Export complete: {export_path}")
+        logger.info("Set YOLO_ENGINE_PATH to this file to serve it")
+        logger.info("=" * 60)
+        
+        return 0
+    
+    except Exception as e:
+        logger.error(f"Model export failed: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
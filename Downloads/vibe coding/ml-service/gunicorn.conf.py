@@ -11,14 +11,17 @@ bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker processes
-workers = int(os.getenv('GUNICORN_WORKERS', 2))
+# A single worker keeps one copy of the model in memory; its request threads
+# queue YOLO jobs onto one inference thread (see services/inference_worker.py)
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
 worker_class = 'gthread'
-threads = int(os.getenv('GUNICORN_THREADS', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 16))
 worker_connections = 1000
 max_requests = 1000
 max_requests_jitter = 50
 timeout = 120
-keepalive = 5
+# Outlive the load balancer's 60s idle timeout so clients reuse connections
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 65))
 
 # Logging
 accesslog = '-'
@@ -40,3 +43,10 @@ tmp_upload_dir = None
 # SSL (if needed in future)
 keyfile = None
 certfile = None
+
+
+# Server hooks
+def post_worker_init(worker):
+    """Load ML services in each worker before it starts serving requests"""
+    from app import init_services
+    init_services()
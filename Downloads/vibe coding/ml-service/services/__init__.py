@@ -7,10 +7,12 @@ from .image_preprocessor import ImagePreprocessor
 from .yolo_detector import YOLODetector
 from .gpt_vision_client import GPTVisionClient
 from .ensemble_aggregator import EnsembleAggregator
+from .inference_worker import InferenceWorker
 
 __all__ = [
     'ImagePreprocessor',
     'YOLODetector',
     'GPTVisionClient',
-    'EnsembleAggregator'
+    'EnsembleAggregator',
+    'InferenceWorker'
 ]
@@ -6,14 +6,229 @@ Combines predictions from YOLO and GPT Vision using ensemble techniques
 import numpy as np
 import logging
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Fallback decorator when numba is not installed"""
+        def decorator(func):
+            return func
+        return decorator
+
 logger = logging.getLogger('ml-service')
 
 
+@njit(cache=True)
+def _box_iou(boxes, areas, i, other_boxes, other_areas, j):
+    """IoU between boxes[i] and other_boxes[j] in [x1, y1, x2, y2] format"""
+    x_left = max(boxes[i, 0], other_boxes[j, 0])
+    y_top = max(boxes[i, 1], other_boxes[j, 1])
+    x_right = min(boxes[i, 2], other_boxes[j, 2])
+    y_bottom = min(boxes[i, 3], other_boxes[j, 3])
+
+    if x_right < x_left or y_bottom < y_top:
+        return 0.0
+
+    intersection = (x_right - x_left) * (y_bottom - y_top)
+    union = areas[i] + other_areas[j] - intersection
+
+    return intersection / union if union > 0 else 0.0
+
+
+@njit(cache=True)
+def _box_overlaps(boxes, areas, i, other_boxes, other_areas, j, threshold):
+    """
+    IoU(boxes[i], other_boxes[j]) >= threshold without the division
+
+    Compares intersection against threshold * union; boxes that do not
+    intersect never overlap, whatever the threshold.
+    """
+    x_left = max(boxes[i, 0], other_boxes[j, 0])
+    y_top = max(boxes[i, 1], other_boxes[j, 1])
+    x_right = min(boxes[i, 2], other_boxes[j, 2])
+    y_bottom = min(boxes[i, 3], other_boxes[j, 3])
+
+    if x_right <= x_left or y_bottom <= y_top:
+        return False
+
+    intersection = (x_right - x_left) * (y_bottom - y_top)
+    return intersection >= threshold * (areas[i] + other_areas[j] - intersection)
+
+
+@njit(cache=True)
+def _iou_matrix(boxes_a, areas_a, boxes_b, areas_b):
+    """Pairwise IoU between two float32 [x1, y1, x2, y2] arrays"""
+    iou = np.empty((boxes_a.shape[0], boxes_b.shape[0]), dtype=np.float32)
+
+    for i in range(boxes_a.shape[0]):
+        for j in range(boxes_b.shape[0]):
+            iou[i, j] = _box_iou(boxes_a, areas_a, i, boxes_b, areas_b, j)
+
+    return iou
+
+
+@njit(cache=True)
+def _match_boxes(boxes_a, areas_a, classes_a, boxes_b, areas_b, classes_b, iou_threshold):
+    """
+    Find the best same-class match in boxes_b for each box in boxes_a
+
+    Returns an index array with -1 where no match exceeds iou_threshold.
+    """
+    matches = np.full(boxes_a.shape[0], -1, dtype=np.int64)
+
+    for i in range(boxes_a.shape[0]):
+        best_iou = 0.0
+        best_j = -1
+        for j in range(boxes_b.shape[0]):
+            if classes_a[i] != classes_b[j]:
+                continue
+            iou = _box_iou(boxes_a, areas_a, i, boxes_b, areas_b, j)
+            if iou > best_iou:
+                best_iou = iou
+                best_j = j
+        if best_iou > iou_threshold:
+            matches[i] = best_j
+
+    return matches
+
+
+@njit(cache=True)
+def _greedy_nms(boxes, areas, order, bounds, nms_threshold):
+    """
+    Greedy NMS over class buckets
+
+    order lists box indices grouped by class, each group sorted by
+    descending confidence; group k spans order[bounds[k]:bounds[k + 1]].
+    Boxes are only compared within their own group. Returns the kept
+    indices in visiting order.
+    """
+    suppressed = np.zeros(boxes.shape[0], dtype=np.bool_)
+    keep = np.empty(boxes.shape[0], dtype=np.int64)
+    kept = 0
+
+    for k in range(bounds.shape[0] - 1):
+        for a in range(bounds[k], bounds[k + 1]):
+            i = order[a]
+            if suppressed[i]:
+                continue
+            keep[kept] = i
+            kept += 1
+
+            for b in range(a + 1, bounds[k + 1]):
+                j = order[b]
+                if not suppressed[j] and _box_overlaps(boxes, areas, i, boxes, areas, j, nms_threshold):
+                    suppressed[j] = True
+
+    return keep[:kept]
+
+
+class DetectionArrays:
+    """
+    Struct-of-arrays view of a detection list
+    
+    Holds contiguous corner coordinates, areas, class codes and confidences so
+    IoU, matching and NMS index flat arrays instead of nested bbox dicts.
+    Row i always describes detections[i] of the list it was built from.
+    """
+    
+    __slots__ = ('boxes', 'areas', 'classes', 'confidences')
+    
+    def __init__(self, boxes, areas, classes, confidences):
+        """
+        Initialize detection arrays
+        
+        Args:
+            boxes: (N, 4) float32 array of [x1, y1, x2, y2]
+            areas: (N,) float32 box areas
+            classes: (N,) int64 class codes
+            confidences: (N,) float64 confidence scores
+        """
+        self.boxes = boxes
+        self.areas = areas
+        self.classes = classes
+        self.confidences = confidences
+    
+    @classmethod
+    def from_detections(cls, detections, class_codes):
+        """
+        Convert detection dicts in a single pass
+        
+        Args:
+            detections: List of detections
+            class_codes: Dict of class name to int code, extended in place so
+                arrays built with the same dict share codes
+            
+        Returns:
+            DetectionArrays: Arrays for the given detections
+        """
+        if not detections:
+            return cls(
+                np.zeros((0, 4), dtype=np.float32),
+                np.zeros(0, dtype=np.float32),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.float64)
+            )
+        
+        xywh = np.array(
+            [[d['bbox']['x'], d['bbox']['y'], d['bbox']['width'], d['bbox']['height']] for d in detections],
+            dtype=np.float32
+        )
+        boxes = np.empty_like(xywh)
+        boxes[:, :2] = xywh[:, :2]
+        boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:]
+        
+        classes = np.array([class_codes.setdefault(d['class'], len(class_codes)) for d in detections],
+                           dtype=np.int64)
+        confidences = np.array([d['confidence'] for d in detections], dtype=np.float64)
+        
+        return cls(boxes, xywh[:, 2] * xywh[:, 3], classes, confidences)
+    
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Stack several DetectionArrays row-wise
+        
+        Args:
+            parts: Iterable of DetectionArrays
+            
+        Returns:
+            DetectionArrays: Rows of all parts in order
+        """
+        parts = list(parts)
+        return cls(
+            np.concatenate([p.boxes for p in parts]),
+            np.concatenate([p.areas for p in parts]),
+            np.concatenate([p.classes for p in parts]),
+            np.concatenate([p.confidences for p in parts])
+        )
+    
+    def take(self, indices):
+        """
+        Select rows by index
+        
+        Args:
+            indices: Integer index array
+            
+        Returns:
+            DetectionArrays: Selected rows
+        """
+        return DetectionArrays(self.boxes[indices], self.areas[indices],
+                               self.classes[indices], self.confidences[indices])
+    
+    def __len__(self):
+        return len(self.confidences)
+
+
 class EnsembleAggregator:
     """
     Ensemble aggregator for combining YOLO and GPT Vision predictions
     """
     
+    __slots__ = ('yolo_weight', 'gpt_weight', 'iou_threshold', 'nms_threshold')
+    
     def __init__(self, yolo_weight=0.6, gpt_weight=0.4, iou_threshold=0.5, nms_threshold=0.4):
         """
         Initialize ensemble aggregator
@@ -31,19 +246,44 @@ class EnsembleAggregator:
         
         logger.info(f"EnsembleAggregator initialized: "
                    f"weights=(YOLO:{yolo_weight}, GPT:{gpt_weight}), "
-                   f"iou_threshold={iou_threshold}, nms_threshold={nms_threshold}")
+                   f"iou_threshold={iou_threshold}, nms_threshold={nms_threshold}, "
+                   f"numba={NUMBA_AVAILABLE}")
+    
+    def warmup(self):
+        """
+        Compile the per-request numba kernels ahead of the first request
+        
+        _iou_matrix is not on the request path and compiles on first use.
+        No-op when numba is not installed.
+        """
+        if not NUMBA_AVAILABLE:
+            return
+        
+        boxes = np.zeros((1, 4), dtype=np.float32)
+        areas = np.zeros(1, dtype=np.float32)
+        classes = np.zeros(1, dtype=np.int64)
+        _match_boxes(boxes, areas, classes, boxes, areas, classes, self.iou_threshold)
+        _greedy_nms(boxes, areas, np.zeros(1, dtype=np.int64), np.array([0, 1]), self.nms_threshold)
+        logger.info("Ensemble kernels compiled")
     
     def calculate_iou(self, bbox1, bbox2):
         """
         Calculate Intersection over Union (IoU) between two bounding boxes
         
+        Also accepts two arrays of [x1, y1, x2, y2] rows, in which case all
+        pairwise IoUs are computed at once via iou_matrix().
+        
         Args:
-            bbox1: First bounding box {'x': int, 'y': int, 'width': int, 'height': int}
-            bbox2: Second bounding box
+            bbox1: First bounding box {'x': int, 'y': int, 'width': int, 'height': int},
+                or (N, 4) array of [x1, y1, x2, y2]
+            bbox2: Second bounding box, or (M, 4) array of [x1, y1, x2, y2]
             
         Returns:
-            float: IoU value (0.0 to 1.0)
+            float: IoU value (0.0 to 1.0), or (N, M) float32 IoU matrix for array input
         """
+        if isinstance(bbox1, np.ndarray):
+            return self.iou_matrix(np.atleast_2d(bbox1), np.atleast_2d(bbox2))
+        
         # Extract coordinates
         x1_1, y1_1 = bbox1['x'], bbox1['y']
         x2_1, y2_1 = x1_1 + bbox1['width'], y1_1 + bbox1['height']
@@ -72,12 +312,92 @@ class EnsembleAggregator:
         
         return iou
     
-    def apply_nms(self, detections):
+    @staticmethod
+    def bboxes_to_xyxy(detections):
+        """
+        Convert detection bboxes to a corner-coordinate array
+        
+        Args:
+            detections: List of detections with 'bbox' dicts
+            
+        Returns:
+            numpy.ndarray: (K, 4) float32 array of [x1, y1, x2, y2]
+        """
+        return DetectionArrays.from_detections(detections, {}).boxes
+    
+    @staticmethod
+    def iou_matrix(boxes_a, boxes_b, areas_a=None, areas_b=None):
+        """
+        Calculate pairwise IoU between two sets of boxes
+        
+        Uses the numba kernel when available, otherwise one NumPy
+        broadcast. Both paths work in float32, which is ample for pixel
+        coordinates and halves the size of the matrix.
+        
+        Args:
+            boxes_a: (N, 4) array of [x1, y1, x2, y2]
+            boxes_b: (M, 4) array of [x1, y1, x2, y2]
+            areas_a: Precomputed (N,) areas of boxes_a (optional)
+            areas_b: Precomputed (M,) areas of boxes_b (optional)
+            
+        Returns:
+            numpy.ndarray: (N, M) float32 IoU matrix
+        """
+        boxes_a = np.ascontiguousarray(boxes_a, dtype=np.float32)
+        boxes_b = np.ascontiguousarray(boxes_b, dtype=np.float32)
+        
+        if areas_a is None:
+            areas_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+        if areas_b is None:
+            areas_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+        areas_a = np.ascontiguousarray(areas_a, dtype=np.float32)
+        areas_b = np.ascontiguousarray(areas_b, dtype=np.float32)
+        
+        if NUMBA_AVAILABLE:
+            return _iou_matrix(boxes_a, areas_a, boxes_b, areas_b)
+        
+        x_left = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+        y_top = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+        x_right = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+        y_bottom = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+        
+        intersection = np.clip(x_right - x_left, 0, None) * np.clip(y_bottom - y_top, 0, None)
+        union = areas_a[:, None] + areas_b[None, :] - intersection
+        
+        return intersection / (union + np.float32(1e-9))
+    
+    @staticmethod
+    def overlap_matrix(boxes_a, boxes_b, threshold, areas_a, areas_b):
+        """
+        Pairwise IoU >= threshold test without dividing by the union
+        
+        Args:
+            boxes_a: (N, 4) array of [x1, y1, x2, y2]
+            boxes_b: (M, 4) array of [x1, y1, x2, y2]
+            threshold: IoU threshold
+            areas_a: (N,) areas of boxes_a
+            areas_b: (M,) areas of boxes_b
+            
+        Returns:
+            numpy.ndarray: (N, M) boolean matrix
+        """
+        x_left = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+        y_top = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+        x_right = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+        y_bottom = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+        
+        intersection = np.clip(x_right - x_left, 0, None) * np.clip(y_bottom - y_top, 0, None)
+        union = areas_a[:, None] + areas_b[None, :] - intersection
+        
+        return (intersection > 0) & (intersection >= threshold * union)
+    
+    def apply_nms(self, detections, arrays=None):
         """
         Apply Non-Maximum Suppression to remove duplicate detections
         
         Args:
             detections: List of detections
+            arrays: DetectionArrays for detections, built here if omitted
             
         Returns:
             list: Filtered detections after NMS
@@ -85,28 +405,40 @@ class EnsembleAggregator:
         if not detections:
             return []
         
-        # Sort by confidence (descending)
-        sorted_detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)
+        if arrays is None:
+            arrays = DetectionArrays.from_detections(detections, {})
         
-        # Apply NMS
-        keep = []
-        while sorted_detections:
-            # Take detection with highest confidence
-            current = sorted_detections.pop(0)
-            keep.append(current)
-            
-            # Remove detections with high IoU
-            filtered = []
-            for det in sorted_detections:
-                # Only compare same class
-                if det['class'] == current['class']:
-                    iou = self.calculate_iou(current['bbox'], det['bbox'])
-                    if iou < self.nms_threshold:
-                        filtered.append(det)
-                else:
-                    filtered.append(det)
-            
-            sorted_detections = filtered
+        # Bucket by class (classes never suppress each other), each bucket in
+        # descending confidence; lexsort is stable so ties keep input order
+        order = np.lexsort((-arrays.confidences, arrays.classes))
+        bounds = np.flatnonzero(np.diff(arrays.classes[order], prepend=-1, append=-1))
+        
+        if NUMBA_AVAILABLE:
+            keep_idx = _greedy_nms(arrays.boxes, arrays.areas, order, bounds, self.nms_threshold)
+        else:
+            keep_idx = []
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                bucket = order[start:end]
+                
+                # Pairwise overlap test for this class only; the upper
+                # triangle holds the lower-confidence candidates
+                boxes, areas = arrays.boxes[bucket], arrays.areas[bucket]
+                suppresses = self.overlap_matrix(boxes, boxes, self.nms_threshold, areas, areas)
+                
+                # Greedy pass: a box only suppresses later boxes if it survived itself
+                # (plain Fast NMS column-max would let suppressed boxes suppress)
+                alive = np.ones(len(bucket), dtype=bool)
+                for i in range(len(bucket)):
+                    if alive[i]:
+                        alive[i + 1:] &= ~suppresses[i, i + 1:]
+                
+                keep_idx.extend(bucket[alive])
+            keep_idx = np.array(keep_idx, dtype=np.int64)
+        
+        # Return survivors in overall confidence order, as before bucketing
+        keep_idx = keep_idx[np.lexsort((keep_idx, -arrays.confidences[keep_idx]))]
+        
+        keep = [detections[i] for i in keep_idx]
         
         logger.info(f"NMS applied: {len(detections)} -> {len(keep)} detections")
         return keep
@@ -145,6 +477,49 @@ class EnsembleAggregator:
         
         return merged
     
+    def merge_matches(self, yolo_results, yolo, gpt, yolo_idx, gpt_idx):
+        """
+        Merge all matched YOLO/GPT pairs at once
+        
+        Vectorized merge_detections: confidences and bboxes of every pair are
+        combined with array arithmetic, then turned into dicts in one pass.
+        
+        Args:
+            yolo_results: List of YOLO detections
+            yolo: DetectionArrays for yolo_results
+            gpt: DetectionArrays for the GPT detections
+            yolo_idx: Indices of matched YOLO detections
+            gpt_idx: Index of the matching GPT detection for each yolo_idx
+            
+        Returns:
+            tuple: (list of merged detections, DetectionArrays for them)
+        """
+        confidences = (yolo.confidences[yolo_idx] * self.yolo_weight +
+                       gpt.confidences[gpt_idx] * self.gpt_weight)
+        
+        # Average x, y, width and height, truncating like int() does
+        yolo_boxes = yolo.boxes[yolo_idx].astype(np.float64)
+        gpt_boxes = gpt.boxes[gpt_idx].astype(np.float64)
+        yolo_xywh = np.hstack([yolo_boxes[:, :2], yolo_boxes[:, 2:] - yolo_boxes[:, :2]])
+        gpt_xywh = np.hstack([gpt_boxes[:, :2], gpt_boxes[:, 2:] - gpt_boxes[:, :2]])
+        xywh = np.trunc((yolo_xywh + gpt_xywh) / 2).astype(np.int64)
+        
+        merged = [
+            {
+                'class': yolo_results[i]['class'],
+                'confidence': confidence,
+                'bbox': {'x': x, 'y': y, 'width': width, 'height': height},
+                'source': 'ensemble'
+            }
+            for i, confidence, (x, y, width, height) in zip(yolo_idx.tolist(), confidences.tolist(), xywh.tolist())
+        ]
+        
+        boxes = np.hstack([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]]).astype(np.float32)
+        areas = (xywh[:, 2] * xywh[:, 3]).astype(np.float32)
+        arrays = DetectionArrays(boxes, areas, yolo.classes[yolo_idx], confidences)
+        
+        return merged, arrays
+    
     def weighted_voting(self, det1, det2):
         """
         Resolve conflicting predictions using weighted voting
@@ -172,6 +547,28 @@ class EnsembleAggregator:
         
         return selected
     
+    def filter_and_nms(self, detections):
+        """
+        Keep confident detections from a single model and remove duplicates
+        
+        Used by aggregate() when the other model found nothing, so no IoU
+        matching or merging is needed.
+        
+        Args:
+            detections: List of detections from one model
+            
+        Returns:
+            list: Detections with confidence > 0.7 after NMS
+        """
+        confident = [det for det in detections if det['confidence'] > 0.7]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for det in confident:
+                logger.debug(f"Adding unmatched {det['source'].upper()} detection: {det['class']} "
+                           f"(conf={det['confidence']:.2f})")
+        
+        return self.apply_nms(confident)
+    
     def aggregate(self, yolo_results, gpt_results):
         """
         Aggregate YOLO and GPT Vision results using ensemble techniques
@@ -186,70 +583,86 @@ class EnsembleAggregator:
         try:
             logger.info(f"Aggregating results: YOLO={len(yolo_results)}, GPT={len(gpt_results)}")
             
+            if not yolo_results and not gpt_results:
+                return []
+            
             # Tag detections with source
             for det in yolo_results:
                 det['source'] = 'yolo'
             for det in gpt_results:
                 det['source'] = 'gpt'
             
-            # Track matched detections
-            matched_yolo = set()
-            matched_gpt = set()
-            ensemble_detections = []
-            
-            # Find matching detections between YOLO and GPT
-            for i, yolo_det in enumerate(yolo_results):
-                best_match = None
-                best_iou = 0.0
-                best_match_idx = -1
+            # Only one model found anything: nothing to match or merge
+            if not yolo_results or not gpt_results:
+                final_detections = self.filter_and_nms(yolo_results or gpt_results)
+            else:
+                # Convert both lists to flat arrays once, with shared class codes
+                class_codes = {}
+                yolo = DetectionArrays.from_detections(yolo_results, class_codes)
+                gpt = DetectionArrays.from_detections(gpt_results, class_codes)
+                
+                # Track matched detections
+                matched_yolo = np.zeros(len(yolo_results), dtype=bool)
+                matched_gpt = np.zeros(len(gpt_results), dtype=bool)
+                
+                # Find matching detections between YOLO and GPT
+                if NUMBA_AVAILABLE:
+                    matches = _match_boxes(
+                        yolo.boxes, yolo.areas, yolo.classes,
+                        gpt.boxes, gpt.areas, gpt.classes,
+                        self.iou_threshold
+                    )
+                    
+                    yolo_idx = np.flatnonzero(matches >= 0)
+                    gpt_idx = matches[yolo_idx]
                 
-                for j, gpt_det in enumerate(gpt_results):
+                else:
+                    iou = self.iou_matrix(yolo.boxes, gpt.boxes, yolo.areas, gpt.areas)
+                    
                     # Only match same class
-                    if yolo_det['class'] == gpt_det['class']:
-                        iou = self.calculate_iou(yolo_det['bbox'], gpt_det['bbox'])
-                        if iou > best_iou:
-                            best_iou = iou
-                            best_match = gpt_det
-                            best_match_idx = j
+                    iou[yolo.classes[:, None] != gpt.classes[None, :]] = 0.0
+                    
+                    # Best GPT match per YOLO detection; IoU > threshold means both models agree
+                    best_match_idx = iou.argmax(axis=1)
+                    best_iou = iou[np.arange(len(yolo_results)), best_match_idx]
+                    
+                    yolo_idx = np.flatnonzero(best_iou > self.iou_threshold)
+                    gpt_idx = best_match_idx[yolo_idx]
                 
-                # If IoU > threshold, both models agree
-                if best_iou > self.iou_threshold:
-                    logger.debug(f"Match found: {yolo_det['class']} (IoU={best_iou:.2f})")
-                    merged = self.merge_detections(yolo_det, best_match)
-                    ensemble_detections.append(merged)
-                    matched_yolo.add(i)
-                    matched_gpt.add(best_match_idx)
-            
-            # Add unmatched YOLO detections (if confidence > threshold)
-            for i, yolo_det in enumerate(yolo_results):
-                if i not in matched_yolo:
-                    # Use YOLO detection if confidence is high enough
-                    if yolo_det['confidence'] > 0.7:
-                        logger.debug(f"Adding unmatched YOLO detection: {yolo_det['class']} "
-                                   f"(conf={yolo_det['confidence']:.2f})")
-                        ensemble_detections.append(yolo_det)
-            
-            # Add unmatched GPT detections (if confidence > threshold)
-            for j, gpt_det in enumerate(gpt_results):
-                if j not in matched_gpt:
-                    # Use GPT detection if confidence is high enough
-                    if gpt_det['confidence'] > 0.7:
-                        logger.debug(f"Adding unmatched GPT detection: {gpt_det['class']} "
-                                   f"(conf={gpt_det['confidence']:.2f})")
-                        ensemble_detections.append(gpt_det)
-            
-            # Apply NMS to remove duplicates
-            final_detections = self.apply_nms(ensemble_detections)
+                logger.debug(f"Matches found: {len(yolo_idx)}")
+                matched_yolo[yolo_idx] = True
+                matched_gpt[gpt_idx] = True
+                
+                # Merge every matched pair in one pass; unmatched rows reuse the arrays built above
+                ensemble_detections, merged_arrays = self.merge_matches(yolo_results, yolo, gpt, yolo_idx, gpt_idx)
+                nms_arrays = [merged_arrays]
+                
+                # Add unmatched detections from either model if confidence is high enough
+                debug = logger.isEnabledFor(logging.DEBUG)
+                for source_results, arrays, matched_mask in ((yolo_results, yolo, matched_yolo),
+                                                             (gpt_results, gpt, matched_gpt)):
+                    unmatched = np.flatnonzero(~matched_mask & (arrays.confidences > 0.7))
+                    singles = [source_results[i] for i in unmatched.tolist()]
+                    if debug:
+                        for det in singles:
+                            logger.debug(f"Adding unmatched {det['source'].upper()} detection: {det['class']} "
+                                       f"(conf={det['confidence']:.2f})")
+                    ensemble_detections.extend(singles)
+                    nms_arrays.append(arrays.take(unmatched))
+                
+                # Apply NMS to remove duplicates
+                final_detections = self.apply_nms(ensemble_detections, DetectionArrays.concatenate(nms_arrays))
             
             # Log summary
             logger.info(f"Ensemble aggregation complete: {len(final_detections)} final detection(s)")
             
-            # Log detection breakdown by source
-            source_counts = {'yolo': 0, 'gpt': 0, 'ensemble': 0}
-            for det in final_detections:
-                source_counts[det['source']] = source_counts.get(det['source'], 0) + 1
-            
-            logger.info(f"Detection sources: {source_counts}")
+            # Log detection breakdown by source (skipped when INFO is off)
+            if logger.isEnabledFor(logging.INFO):
+                source_counts = {'yolo': 0, 'gpt': 0, 'ensemble': 0}
+                for det in final_detections:
+                    source_counts[det['source']] = source_counts.get(det['source'], 0) + 1
+                
+                logger.info(f"Detection sources: {source_counts}")
             
             return final_detections
             
@@ -5,11 +5,18 @@ Handles aircraft defect detection using OpenAI GPT-4 Vision API
 
 import cv2
 import numpy as np
+import asyncio
 import base64
 import logging
+import random
+import re
 import time
-from openai import OpenAI
-import json
+import httpx
+from openai import OpenAI, AsyncOpenAI
+import orjson
+from concurrent.futures import Future
+
+from utils import aio
 
 logger = logging.getLogger('ml-service')
 
@@ -35,7 +42,11 @@ class GPTVisionClient:
         'crack'
     ]
     
-    def __init__(self, api_key, model='gpt-4-vision-preview', max_retries=3):
+    # JSON array inside a markdown code block, possibly surrounded by prose
+    JSON_BLOCK_PATTERN = re.compile(r'```(?:json)?\s*(\[.*?\])\s*(?:```|\Z)', re.DOTALL)
+    
+    def __init__(self, api_key, model='gpt-4-vision-preview', max_retries=3, max_concurrency=16,
+                 jpeg_quality=85, keepalive_expiry=60.0):
         """
         Initialize GPT Vision client
         
@@ -43,13 +54,35 @@ class GPTVisionClient:
             api_key: OpenAI API key
             model: GPT Vision model name
             max_retries: Maximum number of retry attempts
+            max_concurrency: Maximum in-flight async API calls (default: 16)
+            jpeg_quality: JPEG quality of uploaded images (default: 85)
+            keepalive_expiry: Seconds idle API connections stay open (default: 60)
         """
         self.api_key = api_key
         self.model = model
         self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.jpeg_quality = jpeg_quality
+        
+        # The prompt only depends on the class list, so build it once
+        self.prompt = self.create_detection_prompt()
         self.client = OpenAI(api_key=api_key) if api_key else None
         
-        logger.info(f"GPTVisionClient initialized: model={model}, max_retries={max_retries}")
+        # Async calls share one pooled HTTP client on the background event loop.
+        # The pool matches max_concurrency and idle connections are kept well
+        # past httpx's 5s default, so bursts reuse warm TLS connections.
+        self.async_client = None
+        if api_key:
+            http_client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+                keepalive_expiry=keepalive_expiry
+            ))
+            self.async_client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+        self._semaphore = None
+        
+        logger.info(f"GPTVisionClient initialized: model={model}, max_retries={max_retries}, "
+                    f"max_concurrency={max_concurrency}")
     
     def encode_image_to_base64(self, image):
         """
@@ -62,16 +95,13 @@ class GPTVisionClient:
             str: Base64 encoded image
         """
         try:
-            # Convert BGR to RGB
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Encode to JPEG
-            success, buffer = cv2.imencode('.jpg', image_rgb)
+            # Encode to JPEG (imencode expects BGR, so no color conversion)
+            success, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
             if not success:
                 raise Exception("Failed to encode image to JPEG")
             
             # Convert to base64
-            base64_image = base64.b64encode(buffer).decode('utf-8')
+            base64_image = base64.b64encode(buffer).decode('ascii')
             
             logger.debug("Image encoded to base64")
             return base64_image
@@ -118,6 +148,34 @@ Important:
 
         return prompt
     
+    def build_messages(self, base64_image):
+        """
+        Build the chat messages for a detection request
+        
+        Args:
+            base64_image: Base64 encoded JPEG image
+            
+        Returns:
+            list: Chat completion messages
+        """
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": self.prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}"
+                        }
+                    }
+                ]
+            }
+        ]
+    
     def parse_response(self, response_text):
         """
         Parse GPT Vision API response to extract defect information
@@ -135,8 +193,12 @@ Important:
             # GPT might wrap JSON in markdown code blocks
             text = response_text.strip()
             
-            # Remove markdown code blocks if present
-            if text.startswith('```json'):
+            # Take the array out of a code block, ignoring prose around it;
+            # otherwise remove stray markdown fences if present
+            match = self.JSON_BLOCK_PATTERN.search(text)
+            if match:
+                text = match.group(1)
+            elif text.startswith('```json'):
                 text = text[7:]
             elif text.startswith('```'):
                 text = text[3:]
@@ -147,7 +209,7 @@ Important:
             text = text.strip()
             
             # Parse JSON
-            detections_raw = json.loads(text)
+            detections_raw = orjson.loads(text)
             
             # Validate and format detections
             detections = []
@@ -187,7 +249,7 @@ Important:
             logger.info(f"Parsed {len(detections)} detection(s) from GPT response")
             return detections
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON from GPT response: {str(e)}")
             logger.debug(f"Response text: {response_text}")
             return []
@@ -195,13 +257,34 @@ Important:
             logger.error(f"Failed to parse GPT response: {str(e)}")
             return []
     
-    def analyze_image(self, image, retry_count=0):
+    @staticmethod
+    def backoff_delay(retry_count):
+        """
+        Exponential backoff with jitter before a retry
+        
+        The random factor spreads out retries from requests that failed
+        together (e.g. on a rate limit) so they do not hit the API in lockstep.
+        
+        Args:
+            retry_count: Number of attempts already retried
+            
+        Returns:
+            float: Seconds to wait, between 0.5x and 1.5x of 2 ** retry_count
+        """
+        return 2 ** retry_count * random.uniform(0.5, 1.5)
+    
+    def analyze_image(self, image, retry_count=0, messages=None):
         """
         Analyze image using GPT-4 Vision API
         
+        Blocking variant for scripts; it holds the calling thread through
+        the retry backoff. The service uses submit()/analyze_sync().
+        
         Args:
             image: numpy.ndarray image in BGR format
             retry_count: Current retry attempt
+            messages: Request messages from an earlier attempt, reused so
+                retries do not re-encode the image
             
         Returns:
             list: Detections in standard format
@@ -215,32 +298,14 @@ Important:
             
             logger.info("Analyzing image with GPT Vision API...")
             
-            # Encode image to base64
-            base64_image = self.encode_image_to_base64(image)
-            
-            # Create prompt
-            prompt = self.create_detection_prompt()
+            # Encode image to base64 once per request
+            if messages is None:
+                messages = self.build_messages(self.encode_image_to_base64(image))
             
             # Call GPT Vision API
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=messages,
                 max_tokens=1000
             )
             
@@ -261,10 +326,10 @@ Important:
             
             # Retry logic
             if retry_count < self.max_retries:
-                wait_time = 2 ** retry_count  # Exponential backoff
-                logger.info(f"Retrying in {wait_time} seconds... (attempt {retry_count + 1}/{self.max_retries})")
+                wait_time = self.backoff_delay(retry_count)
+                logger.info(f"Retrying in {wait_time:.1f} seconds... (attempt {retry_count + 1}/{self.max_retries})")
                 time.sleep(wait_time)
-                return self.analyze_image(image, retry_count + 1)
+                return self.analyze_image(image, retry_count + 1, messages)
             else:
                 logger.error(f"Max retries ({self.max_retries}) reached, giving up")
                 raise Exception(error_msg)
@@ -273,16 +338,135 @@ Important:
         """
         Analyze image with timeout
         
+        Runs on the async client, so retry backoff awaits instead of
+        sleeping a thread and the timeout covers all attempts.
+        
         Args:
             image: numpy.ndarray image in BGR format
             timeout: Timeout in seconds
             
+        Returns:
+            list: Detections in standard format (empty on failure to allow
+                ensemble to continue)
+        """
+        detections = self.analyze_sync(image, timeout=timeout)
+        return detections if detections is not None else []
+    
+    async def analyze(self, base64_image, retry_count=0, messages=None):
+        """
+        Analyze an encoded image using the async GPT-4 Vision API
+        
+        Must run on the background event loop (see utils.aio).
+        
+        Args:
+            base64_image: Base64 encoded JPEG image
+            retry_count: Current retry attempt
+            messages: Request messages from an earlier attempt, reused so
+                retries do not rebuild the multi-megabyte data URL
+            
         Returns:
             list: Detections in standard format
+            
+        Raises:
+            Exception: If API call fails after all retries
+        """
+        if not self.async_client:
+            raise Exception("OpenAI API key not configured")
+        
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        if messages is None:
+            messages = self.build_messages(base64_image)
+        
+        try:
+            async with self._semaphore:
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=1000
+                )
+            
+            response_text = response.choices[0].message.content
+            
+            logger.info("GPT Vision API call successful")
+            logger.debug(f"Response: {response_text[:200]}...")
+            
+            return self.parse_response(response_text)
+            
+        except Exception as e:
+            error_msg = f"GPT Vision API call failed: {str(e)}"
+            logger.error(error_msg)
+            
+            # Retry logic; the backoff sleep does not hold a concurrency slot
+            if retry_count < self.max_retries:
+                wait_time = self.backoff_delay(retry_count)
+                logger.info(f"Retrying in {wait_time:.1f} seconds... (attempt {retry_count + 1}/{self.max_retries})")
+                await asyncio.sleep(wait_time)
+                return await self.analyze(base64_image, retry_count + 1, messages)
+            else:
+                logger.error(f"Max retries ({self.max_retries}) reached, giving up")
+                raise Exception(error_msg)
+    
+    async def _analyze_or_none(self, base64_image, timeout):
+        """
+        Run analyze() under a timeout, returning None on failure
+        
+        None (rather than an empty list) lets callers tell a failed analysis
+        apart from an image GPT found no defects in.
+        
+        Args:
+            base64_image: Base64 encoded JPEG image
+            timeout: Timeout in seconds
+            
+        Returns:
+            list: Detections in standard format, or None on failure or timeout
         """
         try:
-            return self.analyze_image(image)
+            return await asyncio.wait_for(self.analyze(base64_image), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"GPT Vision analysis timed out after {timeout}s")
+            return None
         except Exception as e:
             logger.error(f"GPT Vision analysis failed: {str(e)}")
-            # Return empty list on failure to allow ensemble to continue
-            return []
+            return None
+    
+    def submit(self, image, timeout=30, base64_image=None):
+        """
+        Start GPT Vision analysis on the shared event loop
+        
+        The image is encoded on the calling thread so the event loop only
+        waits on network I/O.
+        
+        Args:
+            image: numpy.ndarray image in BGR format
+            timeout: Timeout in seconds
+            base64_image: Pre-encoded JPEG payload; skips encoding image
+            
+        Returns:
+            concurrent.futures.Future: Resolves to detections, or None on
+                failure, timeout or a missing API key
+        """
+        if not self.async_client:
+            logger.error("GPT Vision analysis skipped: OpenAI API key not configured")
+            future = Future()
+            future.set_result(None)
+            return future
+        
+        if base64_image is None:
+            base64_image = self.encode_image_to_base64(image)
+        
+        return aio.submit(self._analyze_or_none(base64_image, timeout))
+    
+    def analyze_sync(self, image, timeout=30):
+        """
+        Analyze image on the shared event loop and block for the result
+        
+        Args:
+            image: numpy.ndarray image in BGR format
+            timeout: Timeout in seconds
+            
+        Returns:
+            list: Detections in standard format, or None on failure
+        """
+        return self.submit(image, timeout).result()
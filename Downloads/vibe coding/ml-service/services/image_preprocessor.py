@@ -5,21 +5,41 @@ Handles image loading, validation, and preprocessing for ML inference
 
 import cv2
 import numpy as np
-from PIL import Image
+import base64
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
 import logging
 
 logger = logging.getLogger('ml-service')
 
 
+def _brightness_lut(alpha, beta):
+    """Per-intensity table equal to cv2.addWeighted(image, alpha, 0, 0, beta)"""
+    ramp = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    return cv2.addWeighted(ramp, alpha, ramp, 0, beta)
+
+
 class ImagePreprocessor:
     """
     Image preprocessing service for aircraft defect detection
     Handles image loading, validation, resizing, and quality enhancement
     """
     
-    def __init__(self, target_size=640, min_size=640, max_size=4096):
+    # Longest side of the grayscale sample used for the sharpness score
+    QUALITY_SAMPLE_SIZE = 256
+    # Laplacian variance (at QUALITY_SAMPLE_SIZE) that earns full sharpness points
+    SHARPNESS_FULL_SCALE = 2000.0
+    # Chunk size used when streaming image downloads
+    DOWNLOAD_CHUNK_SIZE = 65536
+    # Glare reduction and shadow enhancement as lookup tables
+    GLARE_LUT = _brightness_lut(0.8, -20)
+    SHADOW_LUT = _brightness_lut(1.2, 20)
+    
+    def __init__(self, target_size=640, min_size=640, max_size=4096, buffer_pool=None, http_pool_size=16,
+                 gpt_jpeg_quality=85, max_download_bytes=50 * 1024 * 1024,
+                 gpt_passthrough_max_bytes=2 * 1024 * 1024):
         """
         Initialize image preprocessor
         
@@ -27,12 +47,106 @@ class ImagePreprocessor:
             target_size: Target size for YOLO input (default: 640x640)
             min_size: Minimum acceptable image dimension
             max_size: Maximum acceptable image dimension
+            buffer_pool: Optional BufferPool of (target_size, target_size, 3)
+                uint8 arrays used for the YOLO input image
+            http_pool_size: Keep-alive connections kept per image host (default: 16)
+            gpt_jpeg_quality: JPEG quality of the GPT Vision payload (default: 85)
+            max_download_bytes: Largest encoded image accepted from a URL (default: 50 MB)
+            gpt_passthrough_max_bytes: Downloaded JPEGs up to this size are sent
+                to GPT Vision as-is instead of re-encoded (default: 2 MB; 0 disables)
         """
         self.target_size = target_size
         self.min_size = min_size
         self.max_size = max_size
+        self.buffer_pool = buffer_pool
+        self.gpt_jpeg_quality = gpt_jpeg_quality
+        self.max_download_bytes = max_download_bytes
+        self.gpt_passthrough_max_bytes = gpt_passthrough_max_bytes
+        
+        # CLAHE objects keep internal buffers, so each request thread gets its own
+        self._local = threading.local()
+        
+        # Shared session so image downloads reuse TCP/TLS connections to S3
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         logger.info(f"ImagePreprocessor initialized: target={target_size}, range={min_size}-{max_size}")
     
+    def download_image(self, image_url, timeout=30):
+        """
+        Download raw image bytes over the pooled HTTP session
+        
+        The body is streamed in chunks and the download is aborted as soon
+        as it exceeds max_download_bytes, so an oversized URL never gets
+        buffered in full.
+        
+        Args:
+            image_url: URL to the image
+            timeout: Request timeout in seconds
+            
+        Returns:
+            bytearray: Encoded image data
+            
+        Raises:
+            requests.exceptions.RequestException: If the download fails
+            ValueError: If the image exceeds max_download_bytes
+        """
+        response = self.session.get(image_url, timeout=timeout, stream=True)
+        try:
+            response.raise_for_status()
+            
+            content_length = int(response.headers.get('Content-Length') or 0)
+            if content_length > self.max_download_bytes:
+                raise ValueError(f"Image too large: {content_length} bytes "
+                                 f"(maximum: {self.max_download_bytes})")
+            
+            content = bytearray()
+            for chunk in response.iter_content(self.DOWNLOAD_CHUNK_SIZE):
+                content += chunk
+                if len(content) > self.max_download_bytes:
+                    raise ValueError(f"Image too large: more than {self.max_download_bytes} bytes")
+            
+            return content
+        finally:
+            response.close()
+    
+    def decode_image(self, content):
+        """
+        Decode encoded image bytes straight to a BGR array
+        
+        OpenCV decodes directly into BGR in one pass; PIL is only used for
+        formats OpenCV cannot read (e.g. GIF).
+        
+        Args:
+            content: Encoded image bytes
+            
+        Returns:
+            numpy.ndarray: Decoded image in BGR format
+            
+        Raises:
+            ValueError: If the bytes are not a readable image
+        """
+        # EXIF orientation is ignored to match the PIL decoding used before
+        image_bgr = cv2.imdecode(
+            np.frombuffer(content, dtype=np.uint8),
+            cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+        )
+        if image_bgr is not None:
+            return image_bgr
+        
+        # Only needed for the rare formats above, so import on demand
+        from PIL import Image
+        
+        pil_image = Image.open(BytesIO(content))
+        
+        # Convert to RGB if necessary
+        if pil_image.mode != 'RGB':
+            pil_image = pil_image.convert('RGB')
+        
+        # Convert RGB to BGR for OpenCV
+        return cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
+    
     def load_image_from_url(self, image_url, timeout=30):
         """
         Load image from S3 URL or HTTP URL
@@ -51,21 +165,9 @@ class ImagePreprocessor:
             logger.info(f"Loading image from URL: {image_url}")
             
             # Download image
-            response = requests.get(image_url, timeout=timeout)
-            response.raise_for_status()
-            
-            # Convert to PIL Image
-            pil_image = Image.open(BytesIO(response.content))
-            
-            # Convert to RGB if necessary
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
+            content = self.download_image(image_url, timeout=timeout)
             
-            # Convert to numpy array (RGB)
-            image_rgb = np.array(pil_image)
-            
-            # Convert RGB to BGR for OpenCV
-            image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+            image_bgr = self.decode_image(content)
             
             logger.info(f"Image loaded successfully: shape={image_bgr.shape}")
             return image_bgr
@@ -109,12 +211,13 @@ class ImagePreprocessor:
         logger.info(f"Image dimensions validated: {width}x{height}")
         return True
     
-    def resize_for_yolo(self, image):
+    def resize_for_yolo(self, image, out=None):
         """
         Resize image to YOLO input size while maintaining aspect ratio
         
         Args:
             image: numpy.ndarray image in BGR format
+            out: Optional (target_size, target_size, 3) uint8 array to write into
             
         Returns:
             numpy.ndarray: Resized image
@@ -128,22 +231,49 @@ class ImagePreprocessor:
         new_width = int(width * scale)
         new_height = int(height * scale)
         
-        # Resize image
-        resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-        
-        # Create padded image (letterbox)
-        padded = np.full((self.target_size, self.target_size, 3), 114, dtype=np.uint8)
-        
         # Calculate padding offsets
         x_offset = (self.target_size - new_width) // 2
         y_offset = (self.target_size - new_height) // 2
         
-        # Place resized image in center
-        padded[y_offset:y_offset+new_height, x_offset:x_offset+new_width] = resized
+        # Letterbox canvas; only the padding bands are filled below
+        if out is None:
+            padded = np.empty((self.target_size, self.target_size, 3), dtype=np.uint8)
+        else:
+            padded = out
+        
+        padded[:y_offset] = 114
+        padded[y_offset+new_height:] = 114
+        padded[y_offset:y_offset+new_height, :x_offset] = 114
+        padded[y_offset:y_offset+new_height, x_offset+new_width:] = 114
+        
+        # Resize straight into the center of the canvas (no intermediate array)
+        cv2.resize(image, (new_width, new_height),
+                   dst=padded[y_offset:y_offset+new_height, x_offset:x_offset+new_width],
+                   interpolation=cv2.INTER_LINEAR)
         
         logger.info(f"Image resized: {width}x{height} -> {self.target_size}x{self.target_size}")
         return padded
     
+    def _get_clahe(self, clip_limit, tile_grid_size):
+        """
+        Get this thread's CLAHE instance for the given parameters
+        
+        Args:
+            clip_limit: Threshold for contrast limiting
+            tile_grid_size: Size of grid for histogram equalization
+            
+        Returns:
+            cv2.CLAHE: Reusable CLAHE object
+        """
+        cache = getattr(self._local, 'clahe', None)
+        if cache is None:
+            cache = self._local.clahe = {}
+        
+        key = (clip_limit, tuple(tile_grid_size))
+        if key not in cache:
+            cache[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+        return cache[key]
+    
     def normalize_brightness_contrast(self, image, clip_limit=2.0, tile_grid_size=(8, 8)):
         """
         Normalize brightness and contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)
@@ -159,18 +289,14 @@ class ImagePreprocessor:
         # Convert to LAB color space
         lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
         
-        # Split channels
-        l, a, b = cv2.split(lab)
-        
-        # Apply CLAHE to L channel
-        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
-        l_normalized = clahe.apply(l)
-        
-        # Merge channels
-        lab_normalized = cv2.merge([l_normalized, a, b])
+        # Apply CLAHE to the L channel only and write it back in place
+        # (a and b are never touched, so no split/merge copies)
+        clahe = self._get_clahe(clip_limit, tile_grid_size)
+        l_normalized = clahe.apply(cv2.extractChannel(lab, 0))
+        cv2.insertChannel(l_normalized, lab, 0)
         
         # Convert back to BGR
-        normalized = cv2.cvtColor(lab_normalized, cv2.COLOR_LAB2BGR)
+        normalized = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
         
         logger.debug("Brightness and contrast normalized")
         return normalized
@@ -185,11 +311,10 @@ class ImagePreprocessor:
         Returns:
             numpy.ndarray: Filtered image
         """
-        # Convert to grayscale for analysis
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Calculate mean brightness
-        mean_brightness = np.mean(gray)
+        # Mean grayscale brightness from the per-channel means (gray is a
+        # weighted sum of B, G, R, so no grayscale image is needed)
+        mean_b, mean_g, mean_r, _ = cv2.mean(image)
+        mean_brightness = 0.114 * mean_b + 0.587 * mean_g + 0.299 * mean_r
         
         # Apply bilateral filter to reduce noise while preserving edges
         filtered = cv2.bilateralFilter(image, d=9, sigmaColor=75, sigmaSpace=75)
@@ -198,17 +323,27 @@ class ImagePreprocessor:
         if mean_brightness > 180:
             logger.debug("High brightness detected, applying glare reduction")
             # Reduce highlights
-            filtered = cv2.addWeighted(filtered, 0.8, np.zeros_like(filtered), 0, -20)
+            cv2.LUT(filtered, self.GLARE_LUT, dst=filtered)
         
         # If image is too dark (shadows), apply additional processing
         elif mean_brightness < 80:
             logger.debug("Low brightness detected, applying shadow enhancement")
             # Enhance shadows
-            filtered = cv2.addWeighted(filtered, 1.2, np.zeros_like(filtered), 0, 20)
+            cv2.LUT(filtered, self.SHADOW_LUT, dst=filtered)
         
         logger.debug("Adaptive filtering applied")
         return filtered
     
+    def release_buffer(self, image):
+        """
+        Return a YOLO input image produced by preprocess() to the buffer pool
+        
+        Args:
+            image: The 'processed' image from preprocess()
+        """
+        if self.buffer_pool is not None:
+            self.buffer_pool.release(image)
+    
     def calculate_quality_score(self, image):
         """
         Calculate image quality score based on sharpness and brightness
@@ -222,12 +357,20 @@ class ImagePreprocessor:
         # Convert to grayscale
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
-        # Calculate sharpness using Laplacian variance
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-        sharpness_score = min(laplacian_var / 1000.0, 1.0) * 50  # Max 50 points
+        # Calculate sharpness using Laplacian variance on a small area-averaged
+        # sample, so the score is resolution independent and cheap on 4K inputs
+        height, width = gray.shape[:2]
+        scale = self.QUALITY_SAMPLE_SIZE / max(height, width)
+        if scale < 1.0:
+            sample = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                interpolation=cv2.INTER_AREA)
+        else:
+            sample = gray
+        laplacian_var = float(cv2.Laplacian(sample, cv2.CV_32F).var())
+        sharpness_score = min(laplacian_var / self.SHARPNESS_FULL_SCALE, 1.0) * 50  # Max 50 points
         
         # Calculate brightness score
-        mean_brightness = np.mean(gray)
+        mean_brightness = float(np.mean(gray))
         # Optimal brightness is around 128, score decreases as it deviates
         brightness_deviation = abs(mean_brightness - 128) / 128.0
         brightness_score = (1.0 - brightness_deviation) * 50  # Max 50 points
@@ -240,27 +383,84 @@ class ImagePreprocessor:
         
         return quality_score
     
-    def preprocess(self, image_url):
+    def is_gpt_passthrough(self, content):
+        """
+        Check whether downloaded bytes can be sent to GPT Vision unchanged
+        
+        Only small RGB/grayscale JPEGs without an EXIF rotation
+        qualify: decoding ignores EXIF orientation, so a rotated original
+        would give GPT a different frame than YOLO. Only the header is read.
+        
+        Args:
+            content: Encoded image bytes as downloaded
+            
+        Returns:
+            bool: True if the bytes can be base64-encoded directly
+        """
+        if not content or len(content) > self.gpt_passthrough_max_bytes:
+            return False
+        if bytes(content[:3]) != b'\xff\xd8\xff':
+            return False
+        
+        from PIL import Image
+        
+        try:
+            with Image.open(BytesIO(content)) as header:
+                return header.mode in ('RGB', 'L') and header.getexif().get(0x0112, 1) == 1
+        except Exception:
+            return False
+    
+    def encode_for_gpt(self, image, encoded=None):
+        """
+        Encode a BGR image as the base64 JPEG payload sent to GPT Vision
+        
+        Args:
+            image: numpy.ndarray image in BGR format
+            encoded: Original downloaded bytes of image; used as-is when
+                is_gpt_passthrough() allows, skipping the JPEG re-encode
+            
+        Returns:
+            str: Base64 encoded JPEG
+            
+        Raises:
+            ValueError: If JPEG encoding fails
+        """
+        if encoded is not None and self.is_gpt_passthrough(encoded):
+            return base64.b64encode(encoded).decode('ascii')
+        
+        success, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.gpt_jpeg_quality])
+        if not success:
+            raise ValueError("Failed to encode image to JPEG")
+        
+        return base64.b64encode(buffer).decode('ascii')
+    
+    def preprocess(self, image_url, include_gpt_payload=False):
         """
         Complete preprocessing pipeline
         
         Args:
             image_url: URL to the image
+            include_gpt_payload: Also encode the original image for GPT Vision
+                once, so the call and its retries reuse the same payload
             
         Returns:
             dict: {
                 'original': Original image (BGR),
                 'processed': Processed image ready for YOLO (BGR),
                 'quality_score': Image quality score (0-100),
-                'dimensions': Original dimensions (width, height)
+                'dimensions': Original dimensions (width, height),
+                'gpt_payload': Base64 JPEG of the original (the downloaded
+                    bytes when they qualify), or None
             }
             
         Raises:
             ValueError: If image processing fails
         """
         try:
-            # Load image from URL
-            original_image = self.load_image_from_url(image_url)
+            # Download and decode, keeping the downloaded bytes for GPT
+            logger.info(f"Loading image from URL: {image_url}")
+            encoded = self.download_image(image_url)
+            original_image = self.decode_image(encoded)
             
             # Store original dimensions
             height, width = original_image.shape[:2]
@@ -272,17 +472,23 @@ class ImagePreprocessor:
             # Calculate quality score on original image
             quality_score = self.calculate_quality_score(original_image)
             
-            # Apply preprocessing
-            processed = original_image.copy()
-            
-            # Normalize brightness and contrast
-            processed = self.normalize_brightness_contrast(processed)
+            # Apply preprocessing (each step returns a new array, so the
+            # original is left untouched for GPT Vision)
+            processed = self.normalize_brightness_contrast(original_image)
             
             # Apply adaptive filtering for glare and shadows
             processed = self.apply_adaptive_filtering(processed)
             
-            # Resize for YOLO
-            processed = self.resize_for_yolo(processed)
+            # Resize for YOLO into a pooled buffer when available
+            out = self.buffer_pool.acquire() if self.buffer_pool is not None else None
+            try:
+                processed = self.resize_for_yolo(processed, out=out)
+                
+                gpt_payload = self.encode_for_gpt(original_image, encoded) if include_gpt_payload else None
+            except Exception:
+                # Nobody else holds the buffer once this call fails
+                self.release_buffer(out)
+                raise
             
             logger.info(f"Preprocessing complete: quality={quality_score:.2f}, "
                        f"original_size={original_dimensions}")
@@ -291,7 +497,8 @@ class ImagePreprocessor:
                 'original': original_image,
                 'processed': processed,
                 'quality_score': quality_score,
-                'dimensions': original_dimensions
+                'dimensions': original_dimensions,
+                'gpt_payload': gpt_payload
             }
             
         except Exception as e:
@@ -0,0 +1,130 @@
+"""
+Inference Worker Service
+Runs YOLO inference on a single dedicated thread fed by a request queue
+"""
+
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger('ml-service')
+
+
+class InferenceWorker:
+    """
+    Single-threaded YOLO inference loop
+
+    Request threads submit preprocessed images and wait on the returned
+    future, so the model is loaded once per process and GPU work is
+    serialized instead of contended. Jobs that arrive close together are
+    micro-batched into a single forward pass.
+    """
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=10):
+        """
+        Initialize inference worker
+
+        Args:
+            detector: YOLODetector instance used for inference
+            max_batch_size: Maximum images per forward pass (default: 8)
+            max_wait_ms: How long to wait for a batch to fill (default: 10)
+        """
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self._thread = None
+
+        logger.info(f"InferenceWorker initialized: max_batch_size={max_batch_size}, "
+                    f"max_wait_ms={max_wait_ms}")
+
+    def start(self):
+        """Start the inference thread (no-op if already running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(target=self._run, name='yolo-inference', daemon=True)
+        self._thread.start()
+        logger.info("Inference thread started")
+
+    def stop(self, timeout=None):
+        """
+        Stop the inference thread after pending jobs are processed
+
+        Args:
+            timeout: Seconds to wait for the thread to exit (optional)
+        """
+        if self._thread is None:
+            return
+
+        self.queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info("Inference thread stopped")
+
+    def submit(self, image, original_dimensions=None):
+        """
+        Queue an image for YOLO detection
+
+        Args:
+            image: numpy.ndarray image in BGR format
+            original_dimensions: Original image dimensions (width, height)
+
+        Returns:
+            concurrent.futures.Future: Resolves to detections in standard format
+        """
+        future = Future()
+        self.queue.put((image, original_dimensions, future))
+        return future
+
+    def _collect_batch(self):
+        """
+        Block for one job, then gather more until the batch is full or the wait expires
+
+        Returns:
+            tuple: (list of jobs, bool stop requested)
+        """
+        job = self.queue.get()
+        if job is None:
+            return [], True
+
+        batch = [job]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+
+        return batch, False
+
+    def _run(self):
+        """Process queued jobs until a stop sentinel is received"""
+        while True:
+            batch, stop = self._collect_batch()
+
+            # Drop jobs whose caller already gave up
+            batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+
+            if batch:
+                images = [job[0] for job in batch]
+                dimensions = [job[1] for job in batch]
+
+                try:
+                    results = self.detector.detect_batch(images, dimensions)
+                except Exception as e:
+                    for job in batch:
+                        job[2].set_exception(e)
+                else:
+                    for job, detections in zip(batch, results):
+                        job[2].set_result(detections)
+
+            if stop:
+                break
@@ -8,9 +8,14 @@ import os
 import pytest
 import numpy as np
 import cv2
-from unittest.mock import Mock, patch, MagicMock
+import time
+import asyncio
+import subprocess
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import json
 import base64
+import gzip
+from concurrent.futures import Future
 from io import BytesIO
 from PIL import Image
 
@@ -20,6 +25,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 # Mock external dependencies before importing services
 sys.modules['ultralytics'] = MagicMock()
 sys.modules['openai'] = MagicMock()
+sys.modules['httpx'] = MagicMock()
 sys.modules['torch'] = MagicMock()
 sys.modules['torchvision'] = MagicMock()
 
@@ -27,7 +33,12 @@ sys.modules['torchvision'] = MagicMock()
 from services.image_preprocessor import ImagePreprocessor
 from services.yolo_detector import YOLODetector
 from services.gpt_vision_client import GPTVisionClient
-from services.ensemble_aggregator import EnsembleAggregator
+from services.ensemble_aggregator import EnsembleAggregator, DetectionArrays
+from services.inference_worker import InferenceWorker
+from utils.result_cache import ResultCache
+from utils.buffer_pool import BufferPool
+from utils.config import Config
+import app as ml_app
 
 
 # ============================================================================
@@ -113,7 +124,7 @@ class TestImagePreprocessor:
         assert preprocessor.min_size == 640
         assert preprocessor.max_size == 4096
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_load_image_from_url_success(self, mock_get, sample_image):
         """Test successful image loading from URL"""
         # Create mock response with image data
@@ -123,7 +134,8 @@ class TestImagePreprocessor:
         img_byte_arr.seek(0)
         
         mock_response = Mock()
-        mock_response.content = img_byte_arr.read()
+        mock_response.headers = {}
+        mock_response.iter_content = Mock(return_value=[img_byte_arr.read()])
         mock_response.raise_for_status = Mock()
         mock_get.return_value = mock_response
         
@@ -133,8 +145,44 @@ class TestImagePreprocessor:
         assert isinstance(result, np.ndarray)
         assert len(result.shape) == 3
         assert result.shape[2] == 3  # BGR format
+        assert mock_get.call_args.kwargs['stream'] is True
+        mock_response.close.assert_called_once()
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
+    def test_download_image_size_cap(self, mock_get):
+        """Test oversized downloads are rejected by header and while streaming"""
+        mock_response = Mock()
+        mock_response.raise_for_status = Mock()
+        mock_get.return_value = mock_response
+        preprocessor = ImagePreprocessor(max_download_bytes=1000)
+        
+        mock_response.headers = {'Content-Length': '5000'}
+        mock_response.iter_content = Mock(return_value=[])
+        with pytest.raises(ValueError, match="too large"):
+            preprocessor.download_image('http://example.com/image.jpg')
+        mock_response.iter_content.assert_not_called()
+        
+        mock_response.headers = {}
+        mock_response.iter_content = Mock(return_value=[b'x' * 600, b'x' * 600, b'x' * 600])
+        with pytest.raises(ValueError, match="too large"):
+            preprocessor.download_image('http://example.com/image.jpg')
+        
+        mock_response.iter_content = Mock(return_value=[b'x' * 600, b'x' * 400])
+        assert len(preprocessor.download_image('http://example.com/image.jpg')) == 1000
+    
+    def test_decode_image_gif_fallback(self):
+        """Test formats OpenCV cannot decode still load through PIL"""
+        pil_image = Image.new('RGB', (16, 16), color=(255, 0, 0))
+        img_byte_arr = BytesIO()
+        pil_image.save(img_byte_arr, format='GIF')
+        
+        preprocessor = ImagePreprocessor()
+        result = preprocessor.decode_image(img_byte_arr.getvalue())
+        
+        assert result.shape == (16, 16, 3)
+        assert tuple(result[0, 0]) == (0, 0, 255)  # BGR
+    
+    @patch('requests.Session.get')
     def test_load_image_from_url_failure(self, mock_get):
         """Test image loading failure"""
         mock_get.side_effect = Exception("Network error")
@@ -193,10 +241,23 @@ class TestImagePreprocessor:
         assert isinstance(quality_score, float)
         assert 0 <= quality_score <= 100
     
-    @patch.object(ImagePreprocessor, 'load_image_from_url')
-    def test_preprocess_pipeline(self, mock_load, sample_image):
+    def test_quality_score_sharpness(self):
+        """Test sharpness score ranks blur and ignores resolution"""
+        preprocessor = ImagePreprocessor()
+        checker = np.kron((np.indices((16, 16)).sum(axis=0) % 2) * 255, np.ones((32, 32))).astype(np.uint8)
+        sharp = cv2.cvtColor(checker, cv2.COLOR_GRAY2BGR)
+        blurred = cv2.GaussianBlur(sharp, (31, 31), 0)
+        upscaled = cv2.resize(sharp, (2048, 2048), interpolation=cv2.INTER_NEAREST)
+        
+        assert preprocessor.calculate_quality_score(blurred) < preprocessor.calculate_quality_score(sharp)
+        assert preprocessor.calculate_quality_score(upscaled) == pytest.approx(
+            preprocessor.calculate_quality_score(sharp), abs=1.0)
+    
+    @patch.object(ImagePreprocessor, 'download_image', return_value=b'')
+    @patch.object(ImagePreprocessor, 'decode_image')
+    def test_preprocess_pipeline(self, mock_decode, mock_download, sample_image):
         """Test complete preprocessing pipeline"""
-        mock_load.return_value = sample_image
+        mock_decode.return_value = sample_image
         
         preprocessor = ImagePreprocessor(target_size=640, min_size=640, max_size=4096)
         result = preprocessor.preprocess('http://example.com/image.jpg')
@@ -207,6 +268,81 @@ class TestImagePreprocessor:
         assert 'dimensions' in result
         assert result['processed'].shape == (640, 640, 3)
         assert isinstance(result['quality_score'], float)
+    
+    @patch.object(ImagePreprocessor, 'download_image', return_value=b'')
+    @patch.object(ImagePreprocessor, 'decode_image')
+    def test_preprocess_uses_buffer_pool(self, mock_decode, mock_download, sample_image):
+        """Test the YOLO input is written into a pooled buffer and can be returned"""
+        mock_decode.return_value = sample_image
+        pool = BufferPool((640, 640, 3), size=1)
+        
+        preprocessor = ImagePreprocessor(target_size=640, min_size=640, max_size=4096, buffer_pool=pool)
+        result = preprocessor.preprocess('http://example.com/image.jpg')
+        
+        assert pool.available() == 0
+        assert result['processed'].shape == (640, 640, 3)
+        assert not np.shares_memory(result['processed'], result['original'])
+        
+        preprocessor.release_buffer(result['processed'])
+        assert pool.available() == 1
+    
+    @patch.object(ImagePreprocessor, 'encode_for_gpt', side_effect=ValueError("encode failed"))
+    @patch.object(ImagePreprocessor, 'download_image', return_value=b'')
+    @patch.object(ImagePreprocessor, 'decode_image')
+    def test_preprocess_failure_returns_buffer(self, mock_decode, mock_download, mock_encode, sample_image):
+        """Test a failure after the pooled buffer is acquired hands it back to the pool"""
+        mock_decode.return_value = sample_image
+        pool = BufferPool((640, 640, 3), size=1)
+        
+        preprocessor = ImagePreprocessor(target_size=640, min_size=640, max_size=4096, buffer_pool=pool)
+        with pytest.raises(ValueError):
+            preprocessor.preprocess('http://example.com/image.jpg', include_gpt_payload=True)
+        
+        mock_encode.assert_called_once()
+        assert pool.available() == 1
+    
+    @patch.object(ImagePreprocessor, 'download_image', return_value=b'')
+    @patch.object(ImagePreprocessor, 'decode_image')
+    def test_preprocess_gpt_payload(self, mock_decode, mock_download):
+        """Test the GPT payload is a BGR JPEG of the original image, encoded on request"""
+        # Solid blue in BGR so a channel swap would be obvious
+        image = np.zeros((800, 800, 3), dtype=np.uint8)
+        image[:, :] = (200, 40, 40)
+        mock_decode.return_value = image
+        
+        preprocessor = ImagePreprocessor(target_size=640, min_size=640, max_size=4096)
+        assert preprocessor.preprocess('http://example.com/image.jpg')['gpt_payload'] is None
+        
+        result = preprocessor.preprocess('http://example.com/image.jpg', include_gpt_payload=True)
+        decoded = cv2.imdecode(np.frombuffer(base64.b64decode(result['gpt_payload']), np.uint8), cv2.IMREAD_COLOR)
+        
+        assert decoded.shape == image.shape
+        assert np.abs(decoded.astype(int) - image.astype(int)).max() < 10
+    
+    @patch('requests.Session.get')
+    def test_preprocess_gpt_payload_reuses_downloaded_jpeg(self, mock_get):
+        """Test small unrotated JPEGs reach GPT as downloaded, rotated ones are re-encoded"""
+        def jpeg_bytes(orientation=None):
+            pil_image = Image.new('RGB', (800, 640), color=(40, 40, 200))
+            exif = Image.Exif()
+            if orientation is not None:
+                exif[0x0112] = orientation
+            buffer = BytesIO()
+            pil_image.save(buffer, format='JPEG', quality=95, exif=exif.tobytes())
+            return buffer.getvalue()
+        
+        mock_response = Mock()
+        mock_response.headers = {}
+        mock_response.raise_for_status = Mock()
+        mock_get.return_value = mock_response
+        preprocessor = ImagePreprocessor(target_size=640, min_size=640, max_size=4096)
+        
+        for orientation, passthrough in ((None, True), (1, True), (6, False)):
+            content = jpeg_bytes(orientation)
+            mock_response.iter_content = Mock(return_value=[content])
+            result = preprocessor.preprocess('http://example.com/image.jpg', include_gpt_payload=True)
+            
+            assert (base64.b64decode(result['gpt_payload']) == content) is passthrough
 
 
 # ============================================================================
@@ -223,7 +359,7 @@ class TestYOLODetector:
         assert detector.confidence_threshold == 0.5
         assert detector.model is None
     
-    @patch('services.yolo_detector.YOLO')
+    @patch('ultralytics.YOLO')
     @patch('os.path.exists')
     def test_load_model_success(self, mock_exists, mock_yolo):
         """Test successful model loading"""
@@ -237,7 +373,7 @@ class TestYOLODetector:
         assert detector.model is not None
         mock_yolo.assert_called_once_with('models/yolov8.pt')
     
-    @patch('services.yolo_detector.YOLO')
+    @patch('ultralytics.YOLO')
     @patch('os.path.exists')
     def test_load_model_fallback(self, mock_exists, mock_yolo):
         """Test model loading with fallback to pre-trained model"""
@@ -251,7 +387,34 @@ class TestYOLODetector:
         assert detector.model is not None
         mock_yolo.assert_called_once_with('yolov8n.pt')
     
-    @patch('services.yolo_detector.YOLO')
+    @patch('ultralytics.YOLO')
+    @patch('os.path.exists')
+    def test_load_model_prefers_engine(self, mock_exists, mock_yolo):
+        """Test an exported engine is loaded instead of the .pt weights"""
+        mock_exists.return_value = True
+        
+        detector = YOLODetector(model_path='models/yolov8.pt', engine_path='models/yolov8.engine')
+        detector.load_model()
+        
+        mock_yolo.assert_called_once_with('models/yolov8.engine', task='detect')
+    
+    @patch('torch.cuda.is_available')
+    @patch('ultralytics.YOLO')
+    @patch('os.path.exists')
+    def test_fp16_only_on_cuda(self, mock_exists, mock_yolo, mock_cuda_available):
+        """Test half precision is enabled only when CUDA is available"""
+        mock_exists.return_value = True
+        
+        mock_cuda_available.return_value = False
+        detector = YOLODetector(model_path='models/yolov8.pt', precision='fp16')
+        detector.load_model()
+        assert detector.half is False
+        
+        mock_cuda_available.return_value = True
+        detector.load_model()
+        assert detector.half is True
+    
+    @patch('ultralytics.YOLO')
     @patch('os.path.exists')
     def test_detect_success(self, mock_exists, mock_yolo, sample_image):
         """Test successful YOLO detection"""
@@ -267,19 +430,61 @@ class TestYOLODetector:
         assert results == mock_results
         mock_model.assert_called_once()
     
+    @patch('ultralytics.YOLO')
+    @patch('os.path.exists')
+    def test_warmup_runs_single_and_full_batch(self, mock_exists, mock_yolo):
+        """Test warmup autotunes both the single-image and full-batch shapes"""
+        mock_exists.return_value = True
+        mock_model = Mock()
+        mock_yolo.return_value = mock_model
+        
+        detector = YOLODetector(model_path='models/yolov8.pt')
+        detector.warmup(batch_size=4)
+        
+        batch_sizes = [len(call.args[0]) for call in mock_model.call_args_list]
+        assert batch_sizes == [1, 4]
+    
+    @patch('torch.compile')
+    @patch('torch.cuda.is_available')
+    @patch('ultralytics.YOLO')
+    @patch('os.path.exists')
+    def test_torch_compile_on_cuda(self, mock_exists, mock_yolo, mock_cuda_available, mock_compile):
+        """Test torch.compile wraps the module the predictor serves and warmup covers every batch size"""
+        mock_exists.return_value = True
+        mock_cuda_available.return_value = True
+        mock_model = Mock()
+        mock_model.predictor = None
+        fused_module = Mock()
+        
+        def setup_predictor(*args, **kwargs):
+            # Ultralytics builds the predictor (and its fused AutoBackend) on the first call
+            if mock_model.predictor is None:
+                mock_model.predictor = Mock()
+                mock_model.predictor.model.model = fused_module
+        
+        mock_model.side_effect = setup_predictor
+        mock_yolo.return_value = mock_model
+        
+        detector = YOLODetector(model_path='models/yolov8.pt', torch_compile=True)
+        detector.load_model()
+        
+        mock_compile.assert_called_once_with(fused_module, mode='reduce-overhead')
+        assert mock_model.predictor.model.model is mock_compile.return_value
+        assert detector.compiled is True
+        
+        mock_model.reset_mock()
+        detector.warmup(batch_size=3)
+        assert [len(call.args[0]) for call in mock_model.call_args_list] == [1, 2, 3]
+        assert mock_model.predictor.model.model is mock_compile.return_value
+    
     def test_postprocess_detections(self):
         """Test post-processing of YOLO results"""
-        # Create mock YOLO result
-        mock_box = Mock()
-        mock_box.xyxy = [Mock()]
-        mock_box.xyxy[0].cpu().numpy.return_value = np.array([100, 150, 150, 210])
-        mock_box.conf = [Mock()]
-        mock_box.conf[0].cpu().numpy.return_value = 0.85
-        mock_box.cls = [Mock()]
-        mock_box.cls[0].cpu().numpy.return_value = 0
+        # Create mock YOLO result; boxes.data rows are [x1, y1, x2, y2, conf, cls]
+        mock_boxes = Mock()
+        mock_boxes.data.cpu().numpy.return_value = np.array([[100, 150, 150, 210, 0.85, 0]])
         
         mock_result = Mock()
-        mock_result.boxes = [mock_box]
+        mock_result.boxes = mock_boxes
         mock_result.names = {0: 'damaged_rivet'}
         
         detector = YOLODetector(model_path='models/yolov8.pt')
@@ -291,6 +496,8 @@ class TestYOLODetector:
         assert 'bbox' in detections[0]
         assert detections[0]['bbox']['x'] == 100
         assert detections[0]['bbox']['y'] == 150
+        assert detections[0]['bbox']['width'] == 50
+        assert detections[0]['bbox']['height'] == 60
     
     @patch.object(YOLODetector, 'detect')
     @patch.object(YOLODetector, 'postprocess')
@@ -305,6 +512,22 @@ class TestYOLODetector:
         assert len(detections) == 2
         assert detections[0]['class'] == 'damaged_rivet'
         assert detections[1]['class'] == 'missing_rivet'
+    
+    @patch.object(YOLODetector, 'postprocess')
+    def test_detect_batch(self, mock_postprocess, sample_image, sample_yolo_detections):
+        """Test batched detection runs one forward pass and splits results per image"""
+        mock_model = Mock()
+        mock_model.return_value = [Mock(), Mock()]
+        mock_postprocess.return_value = sample_yolo_detections
+        
+        detector = YOLODetector(model_path='models/yolov8.pt')
+        detector.model = mock_model
+        results = detector.detect_batch([sample_image, sample_image], [(640, 640), (1280, 960)])
+        
+        assert len(results) == 2
+        mock_model.assert_called_once()
+        assert mock_postprocess.call_count == 2
+        assert mock_postprocess.call_args_list[1][0][1] == (1280, 960)
 
 
 # ============================================================================
@@ -321,6 +544,19 @@ class TestGPTVisionClient:
         assert client.model == 'gpt-4-vision-preview'
         assert client.max_retries == 3
     
+    @patch('services.gpt_vision_client.AsyncOpenAI')
+    @patch('services.gpt_vision_client.httpx')
+    def test_async_client_connection_pool(self, mock_httpx, mock_async_openai):
+        """Test the async client gets a keep-alive pool sized to max_concurrency"""
+        GPTVisionClient(api_key='test-key', max_concurrency=8, keepalive_expiry=30)
+        
+        mock_httpx.Limits.assert_called_once_with(
+            max_connections=8, max_keepalive_connections=8, keepalive_expiry=30
+        )
+        mock_async_openai.assert_called_once_with(
+            api_key='test-key', http_client=mock_httpx.AsyncClient.return_value
+        )
+    
     def test_encode_image_to_base64(self, sample_image):
         """Test image encoding to base64"""
         client = GPTVisionClient(api_key='test-key')
@@ -334,6 +570,17 @@ class TestGPTVisionClient:
         except Exception:
             pytest.fail("Invalid base64 encoding")
     
+    def test_encode_image_keeps_bgr_channels(self):
+        """Test the JPEG payload decodes back to the same BGR colors"""
+        image = np.zeros((100, 100, 3), dtype=np.uint8)
+        image[:, :] = (200, 40, 40)
+        
+        client = GPTVisionClient(api_key='test-key')
+        jpeg = base64.b64decode(client.encode_image_to_base64(image))
+        decoded = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        
+        assert np.abs(decoded.astype(int) - image.astype(int)).max() < 10
+    
     def test_create_detection_prompt(self):
         """Test detection prompt creation"""
         client = GPTVisionClient(api_key='test-key')
@@ -379,6 +626,22 @@ class TestGPTVisionClient:
         assert len(detections) == 1
         assert detections[0]['class'] == 'crack'
     
+    def test_parse_response_with_surrounding_text(self):
+        """Test parsing a markdown code block surrounded by prose"""
+        client = GPTVisionClient(api_key='test-key')
+        response_text = "Here are the defects I found:\n```json\n" + json.dumps([
+            {
+                'class': 'scratch',
+                'confidence': 0.6,
+                'bbox': {'x': 10, 'y': 20, 'width': 30, 'height': 40}
+            }
+        ]) + "\n```\nLet me know if you need more detail."
+        
+        detections = client.parse_response(response_text)
+        
+        assert len(detections) == 1
+        assert detections[0]['class'] == 'scratch'
+    
     def test_parse_response_invalid_json(self):
         """Test parsing invalid JSON response"""
         client = GPTVisionClient(api_key='test-key')
@@ -450,14 +713,90 @@ class TestGPTVisionClient:
         
         assert detections == []
         assert mock_client.chat.completions.create.call_count == 3
+        
+        # The image is encoded once and the same payload is resent on retries
+        sent = [c.kwargs['messages'] for c in mock_client.chat.completions.create.call_args_list]
+        assert sent[0] is sent[1] is sent[2]
     
     def test_analyze_with_timeout(self, sample_image):
         """Test analyze with timeout wrapper"""
-        client = GPTVisionClient(api_key='test-key')
+        client = GPTVisionClient(api_key=None)
         # Without API key, should return empty list
         detections = client.analyze_with_timeout(sample_image, timeout=30)
         
         assert detections == []
+    
+    def test_analyze_sync_uses_async_client(self, sample_image):
+        """Test async analysis on the shared event loop"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = json.dumps([
+            {
+                'class': 'crack',
+                'confidence': 0.9,
+                'bbox': {'x': 10, 'y': 20, 'width': 30, 'height': 40}
+            }
+        ])
+        
+        client = GPTVisionClient(api_key='test-key')
+        client.async_client = Mock()
+        client.async_client.chat.completions.create = AsyncMock(return_value=mock_response)
+        detections = client.analyze_sync(sample_image, timeout=5)
+        
+        assert len(detections) == 1
+        assert detections[0]['class'] == 'crack'
+    
+    @patch('time.sleep')
+    @patch('services.gpt_vision_client.asyncio.sleep', new_callable=AsyncMock)
+    def test_analyze_with_timeout_retries_without_blocking(self, mock_async_sleep, mock_sleep, sample_image):
+        """Test retries back off with asyncio.sleep on the async client"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = json.dumps([])
+        
+        client = GPTVisionClient(api_key='test-key', max_retries=3)
+        client.async_client = Mock()
+        client.async_client.chat.completions.create = AsyncMock(
+            side_effect=[Exception("API Error"), Exception("API Error"), mock_response]
+        )
+        detections = client.analyze_with_timeout(sample_image, timeout=5)
+        
+        assert detections == []
+        assert client.async_client.chat.completions.create.await_count == 3
+        delays = [c.args[0] for c in mock_async_sleep.await_args_list]
+        assert len(delays) == 2
+        assert 0.5 <= delays[0] <= 1.5 and 1.0 <= delays[1] <= 3.0
+        mock_sleep.assert_not_called()
+    
+    def test_analyze_sync_without_api_key_returns_none(self, sample_image):
+        """Test a missing API key resolves to the failure sentinel, not []"""
+        client = GPTVisionClient(api_key=None)
+        
+        assert client.submit(sample_image, timeout=5).result() is None
+        assert client.analyze_sync(sample_image, timeout=5) is None
+    
+    def test_analyze_sync_failure_returns_none(self, sample_image):
+        """Test an API error after all retries resolves to None"""
+        client = GPTVisionClient(api_key='test-key', max_retries=0)
+        client.async_client = Mock()
+        client.async_client.chat.completions.create = AsyncMock(side_effect=Exception("API Error"))
+        
+        assert client.analyze_sync(sample_image, timeout=5) is None
+    
+    def test_analyze_sync_timeout_returns_none(self, sample_image):
+        """Test a slow API call is abandoned after the timeout"""
+        async def slow_create(**kwargs):
+            await asyncio.sleep(10)
+        
+        client = GPTVisionClient(api_key='test-key')
+        client.async_client = Mock()
+        client.async_client.chat.completions.create = slow_create
+        
+        start = time.monotonic()
+        detections = client.analyze_sync(sample_image, timeout=0.1)
+        
+        assert detections is None
+        assert time.monotonic() - start < 5
 
 
 # ============================================================================
@@ -506,6 +845,68 @@ class TestEnsembleAggregator:
         
         assert iou == 1.0
     
+    def test_iou_matrix_matches_pairwise(self, sample_yolo_detections, sample_gpt_detections):
+        """Test vectorized IoU agrees with pairwise calculation"""
+        aggregator = EnsembleAggregator()
+        iou = aggregator.iou_matrix(
+            aggregator.bboxes_to_xyxy(sample_yolo_detections),
+            aggregator.bboxes_to_xyxy(sample_gpt_detections)
+        )
+        
+        assert iou.shape == (2, 2)
+        assert iou.dtype == np.float32
+        for i, yolo_det in enumerate(sample_yolo_detections):
+            for j, gpt_det in enumerate(sample_gpt_detections):
+                expected = aggregator.calculate_iou(yolo_det['bbox'], gpt_det['bbox'])
+                assert abs(iou[i, j] - expected) < 1e-5
+    
+    def test_calculate_iou_array_input(self, sample_yolo_detections, sample_gpt_detections):
+        """Test calculate_iou with box arrays returns the pairwise matrix"""
+        aggregator = EnsembleAggregator()
+        
+        boxes_a = aggregator.bboxes_to_xyxy(sample_yolo_detections)
+        boxes_b = aggregator.bboxes_to_xyxy(sample_gpt_detections)
+        iou = aggregator.calculate_iou(boxes_a, boxes_b)
+        
+        assert iou.shape == (len(sample_yolo_detections), len(sample_gpt_detections))
+        assert iou[0, 0] == pytest.approx(
+            aggregator.calculate_iou(sample_yolo_detections[0]['bbox'], sample_gpt_detections[0]['bbox']), abs=1e-6)
+        assert aggregator.calculate_iou(boxes_a[0], boxes_a[0]).shape == (1, 1)
+    
+    def test_overlap_matrix_matches_iou_threshold(self):
+        """Test the division-free overlap test agrees with thresholding IoU"""
+        rng = np.random.default_rng(0)
+        xy = rng.integers(0, 100, size=(30, 2))
+        wh = rng.integers(1, 60, size=(30, 2))
+        boxes = np.hstack([xy, xy + wh]).astype(np.float32)
+        areas = (wh[:, 0] * wh[:, 1]).astype(np.float32)
+        
+        iou = EnsembleAggregator.iou_matrix(boxes, boxes, areas, areas)
+        for threshold in (0.1, 0.4, 0.5, 0.9):
+            overlaps = EnsembleAggregator.overlap_matrix(boxes, boxes, threshold, areas, areas)
+            np.testing.assert_array_equal(overlaps, iou >= threshold)
+    
+    def test_detection_arrays(self, sample_yolo_detections, sample_gpt_detections):
+        """Test detection dicts convert to shared-code flat arrays"""
+        class_codes = {}
+        yolo = DetectionArrays.from_detections(sample_yolo_detections, class_codes)
+        gpt = DetectionArrays.from_detections(sample_gpt_detections, class_codes)
+        
+        assert len(yolo) == len(sample_yolo_detections)
+        np.testing.assert_array_equal(yolo.boxes, EnsembleAggregator.bboxes_to_xyxy(sample_yolo_detections))
+        for i, det in enumerate(sample_yolo_detections):
+            assert yolo.areas[i] == det['bbox']['width'] * det['bbox']['height']
+            assert yolo.confidences[i] == det['confidence']
+        
+        # Same class name gets the same code across lists
+        for i, yolo_det in enumerate(sample_yolo_detections):
+            for j, gpt_det in enumerate(sample_gpt_detections):
+                assert (yolo.classes[i] == gpt.classes[j]) == (yolo_det['class'] == gpt_det['class'])
+        
+        both = DetectionArrays.concatenate([yolo, gpt.take(np.array([1]))])
+        assert len(both) == len(sample_yolo_detections) + 1
+        assert both.confidences[-1] == sample_gpt_detections[1]['confidence']
+    
     def test_apply_nms(self):
         """Test Non-Maximum Suppression"""
         aggregator = EnsembleAggregator(nms_threshold=0.4)
@@ -533,6 +934,22 @@ class TestEnsembleAggregator:
         assert len(filtered) <= len(detections)
         assert filtered[0]['confidence'] >= 0.75
     
+    @pytest.mark.parametrize('numba_available', [True, False])
+    def test_apply_nms_is_greedy(self, numba_available):
+        """Test a suppressed box cannot suppress boxes it overlaps"""
+        aggregator = EnsembleAggregator(nms_threshold=0.4)
+        detections = [
+            {'class': 'crack', 'confidence': 0.9, 'bbox': {'x': 0, 'y': 0, 'width': 100, 'height': 100}},
+            {'class': 'crack', 'confidence': 0.8, 'bbox': {'x': 40, 'y': 0, 'width': 100, 'height': 100}},
+            {'class': 'crack', 'confidence': 0.7, 'bbox': {'x': 80, 'y': 0, 'width': 100, 'height': 100}}
+        ]
+        
+        with patch('services.ensemble_aggregator.NUMBA_AVAILABLE', numba_available):
+            filtered = aggregator.apply_nms(detections)
+        
+        # The middle box overlaps both neighbours, the outer two barely overlap
+        assert [det['confidence'] for det in filtered] == [0.9, 0.7]
+    
     def test_merge_detections(self):
         """Test merging two matching detections"""
         aggregator = EnsembleAggregator(yolo_weight=0.6, gpt_weight=0.4)
@@ -555,6 +972,22 @@ class TestEnsembleAggregator:
         assert abs(merged['confidence'] - 0.83) < 0.01
         assert 'bbox' in merged
     
+    def test_merge_matches_matches_merge_detections(self, sample_yolo_detections, sample_gpt_detections):
+        """Test the batched merge gives the same dicts as merging pair by pair"""
+        aggregator = EnsembleAggregator(yolo_weight=0.6, gpt_weight=0.4)
+        class_codes = {}
+        yolo = DetectionArrays.from_detections(sample_yolo_detections, class_codes)
+        gpt = DetectionArrays.from_detections(sample_gpt_detections, class_codes)
+        yolo_idx, gpt_idx = np.array([0, 1]), np.array([1, 0])
+        
+        merged, arrays = aggregator.merge_matches(sample_yolo_detections, yolo, gpt, yolo_idx, gpt_idx)
+        
+        expected = [aggregator.merge_detections(sample_yolo_detections[i], sample_gpt_detections[j])
+                    for i, j in zip(yolo_idx, gpt_idx)]
+        assert merged == expected
+        assert all(type(det['bbox']['x']) is int for det in merged)
+        np.testing.assert_array_equal(arrays.boxes, EnsembleAggregator.bboxes_to_xyxy(expected))
+    
     def test_weighted_voting(self):
         """Test weighted voting for conflicting predictions"""
         aggregator = EnsembleAggregator(yolo_weight=0.6, gpt_weight=0.4)
@@ -595,6 +1028,52 @@ class TestEnsembleAggregator:
         ensemble_count = sum(1 for d in final_detections if d.get('source') == 'ensemble')
         assert ensemble_count >= 0
     
+    def test_aggregate_ignores_cross_class_overlap(self):
+        """Test overlapping boxes of different classes are not merged"""
+        aggregator = EnsembleAggregator(iou_threshold=0.5)
+        yolo_results = [
+            {'class': 'crack', 'confidence': 0.9, 'bbox': {'x': 100, 'y': 100, 'width': 50, 'height': 50}},
+            {'class': 'scratch', 'confidence': 0.6, 'bbox': {'x': 300, 'y': 300, 'width': 50, 'height': 50}}
+        ]
+        gpt_results = [
+            {'class': 'scratch', 'confidence': 0.9, 'bbox': {'x': 100, 'y': 100, 'width': 50, 'height': 50}},
+            {'class': 'scratch', 'confidence': 0.6, 'bbox': {'x': 302, 'y': 302, 'width': 50, 'height': 50}}
+        ]
+        
+        final_detections = aggregator.aggregate(yolo_results, gpt_results)
+        sources = sorted(d['source'] for d in final_detections)
+        
+        assert sources == ['ensemble', 'gpt', 'yolo']
+    
+    def test_kernel_path_matches_python_path(self):
+        """Test compiled matching/NMS gives the same result as the pure Python path"""
+        rng = np.random.default_rng(0)
+        
+        def make_detections(n):
+            return [
+                {
+                    'class': ['crack', 'scratch'][int(rng.integers(2))],
+                    'confidence': round(float(rng.random()), 2),
+                    'bbox': {
+                        'x': int(rng.integers(0, 100)), 'y': int(rng.integers(0, 100)),
+                        'width': int(rng.integers(5, 60)), 'height': int(rng.integers(5, 60))
+                    }
+                }
+                for _ in range(n)
+            ]
+        
+        aggregator = EnsembleAggregator()
+        aggregator.warmup()
+        for _ in range(20):
+            yolo_results, gpt_results = make_detections(12), make_detections(12)
+            expected_yolo = [dict(d) for d in yolo_results]
+            expected_gpt = [dict(d) for d in gpt_results]
+            
+            with patch('services.ensemble_aggregator.NUMBA_AVAILABLE', False):
+                expected = aggregator.aggregate(expected_yolo, expected_gpt)
+            
+            assert aggregator.aggregate(yolo_results, gpt_results) == expected
+    
     def test_aggregate_no_matches(self):
         """Test aggregation with no matching detections"""
         aggregator = EnsembleAggregator(yolo_weight=0.6, gpt_weight=0.4)
@@ -647,6 +1126,420 @@ class TestEnsembleAggregator:
         ]
         result = aggregator.aggregate([], gpt_results)
         assert len(result) == 1
+    
+    def test_aggregate_single_source_skips_matching(self):
+        """Test one-sided input is only confidence-filtered and deduplicated"""
+        aggregator = EnsembleAggregator()
+        
+        yolo_results = [
+            {'class': 'crack', 'confidence': 0.9, 'bbox': {'x': 10, 'y': 10, 'width': 50, 'height': 50}},
+            {'class': 'crack', 'confidence': 0.8, 'bbox': {'x': 12, 'y': 12, 'width': 50, 'height': 50}},
+            {'class': 'dent', 'confidence': 0.5, 'bbox': {'x': 200, 'y': 200, 'width': 30, 'height': 30}}
+        ]
+        
+        with patch.object(EnsembleAggregator, 'merge_matches') as mock_merge:
+            result = aggregator.aggregate(yolo_results, [])
+        
+        mock_merge.assert_not_called()
+        assert [det['confidence'] for det in result] == [0.9]
+        assert result[0]['source'] == 'yolo'
+
+
+# ============================================================================
+# InferenceWorker Tests
+# ============================================================================
+
+class TestInferenceWorker:
+    """Test suite for InferenceWorker"""
+    
+    def test_submit_returns_detections(self, sample_image, sample_yolo_detections):
+        """Test queued job resolves with detector output"""
+        detector = Mock()
+        detector.detect_batch.return_value = [sample_yolo_detections]
+        
+        worker = InferenceWorker(detector)
+        worker.start()
+        try:
+            future = worker.submit(sample_image, (640, 640))
+            assert future.result(timeout=5) == sample_yolo_detections
+        finally:
+            worker.stop(timeout=5)
+        
+        detector.detect_batch.assert_called_once_with([sample_image], [(640, 640)])
+    
+    def test_submit_propagates_errors(self, sample_image):
+        """Test detector errors are raised from the future"""
+        detector = Mock()
+        detector.detect_batch.side_effect = Exception("YOLO inference failed")
+        
+        worker = InferenceWorker(detector)
+        worker.start()
+        try:
+            future = worker.submit(sample_image)
+            with pytest.raises(Exception, match="YOLO inference failed"):
+                future.result(timeout=5)
+        finally:
+            worker.stop(timeout=5)
+    
+    def test_queued_jobs_are_batched(self, sample_image):
+        """Test jobs waiting in the queue share one forward pass"""
+        detector = Mock()
+        detector.detect_batch.side_effect = lambda images, dims: [[{'index': i}] for i in range(len(images))]
+        
+        worker = InferenceWorker(detector, max_batch_size=4)
+        futures = [worker.submit(sample_image, (640, 640)) for _ in range(3)]
+        worker.start()
+        try:
+            results = [f.result(timeout=5) for f in futures]
+        finally:
+            worker.stop(timeout=5)
+        
+        assert detector.detect_batch.call_count == 1
+        assert results == [[{'index': 0}], [{'index': 1}], [{'index': 2}]]
+
+
+# ============================================================================
+# ResultCache Tests
+# ============================================================================
+
+class TestResultCache:
+    """Test suite for ResultCache"""
+    
+    def test_key_depends_on_fingerprint(self):
+        """Test model fingerprint changes produce a new key"""
+        key_a = ResultCache.make_key('https://s3/image.jpg', 'model-v1')
+        key_b = ResultCache.make_key('https://s3/image.jpg', 'model-v2')
+        
+        assert key_a != key_b
+        assert key_a == ResultCache.make_key('https://s3/image.jpg', 'model-v1')
+    
+    def test_evicts_least_recently_used(self):
+        """Test the oldest unused entry is evicted when full"""
+        cache = ResultCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+    
+    @patch('utils.result_cache.time.monotonic')
+    def test_entries_expire(self, mock_monotonic):
+        """Test entries are dropped after the TTL"""
+        mock_monotonic.return_value = 100.0
+        cache = ResultCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        
+        mock_monotonic.return_value = 161.0
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+
+# ============================================================================
+# BufferPool Tests
+# ============================================================================
+
+class TestBufferPool:
+    """Test suite for BufferPool"""
+    
+    def test_acquire_reuses_released_buffer(self):
+        """Test released buffers are handed out again"""
+        pool = BufferPool((4, 4, 3), size=2)
+        buffer = pool.acquire()
+        pool.release(buffer)
+        
+        assert pool.acquire() is buffer
+    
+    def test_acquire_allocates_when_empty(self):
+        """Test an empty pool allocates instead of blocking"""
+        pool = BufferPool((4, 4, 3), size=1)
+        first = pool.acquire()
+        second = pool.acquire()
+        
+        assert first is not second
+        assert second.shape == (4, 4, 3)
+        assert second.dtype == np.uint8
+    
+    def test_release_ignores_foreign_buffers(self):
+        """Test buffers of another shape or beyond capacity are dropped"""
+        pool = BufferPool((4, 4, 3), size=1)
+        pool.release(np.empty((8, 8, 3), dtype=np.uint8))
+        pool.release(np.empty((4, 4, 3), dtype=np.uint8))
+        
+        assert pool.available() == 1
+
+
+# ============================================================================
+# Detect Endpoint Tests
+# ============================================================================
+
+def resolved(value):
+    """Create an already completed future"""
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+@pytest.fixture
+def detect_client(sample_image, sample_yolo_detections):
+    """Flask test client with mocked preprocessing, YOLO worker and GPT client"""
+    preprocessor = Mock()
+    preprocessor.preprocess.return_value = {
+        'original': sample_image,
+        'processed': sample_image,
+        'quality_score': 80.0,
+        'dimensions': (640, 640),
+        'gpt_payload': 'payload'
+    }
+    worker = Mock()
+    worker.submit.side_effect = lambda *args: resolved([dict(d) for d in sample_yolo_detections])
+    gpt = Mock()
+    
+    # Tests may swap entries, e.g. a real GPTVisionClient for the mock
+    services = [preprocessor, Mock(), gpt, EnsembleAggregator()]
+    
+    ml_app.result_cache.clear()
+    with patch.object(ml_app, 'get_services', side_effect=lambda: tuple(services)), \
+         patch.object(ml_app, 'inference_worker', worker), \
+         patch.object(Config, 'GPT_CASCADE_MIN_DETECTIONS', 0):
+        yield ml_app.app.test_client(), services, gpt
+    ml_app.result_cache.clear()
+
+
+class TestDetectEndpoint:
+    """Test suite for the /ml/detect endpoint"""
+    
+    def test_detection_is_cached(self, detect_client, sample_gpt_detections):
+        """Test a complete ensemble result is cached"""
+        client, services, gpt = detect_client
+        gpt.submit.return_value = resolved(sample_gpt_detections)
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+        
+        assert response.status_code == 200
+        assert response.get_json()['data']['metadata']['gptDetections'] == 2
+        assert len(ml_app.result_cache) == 1
+    
+    def test_gpt_failure_is_not_cached(self, detect_client):
+        """Test a failed GPT analysis returns YOLO-only results without caching them"""
+        client, services, gpt = detect_client
+        gpt.submit.return_value = resolved(None)
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+        
+        data = response.get_json()['data']
+        assert response.status_code == 200
+        assert data['metadata']['gptDetections'] == 0
+        assert data['metadata']['yoloDetections'] == 2
+        assert len(ml_app.result_cache) == 0
+    
+    def test_gpt_api_error_is_not_cached(self, detect_client):
+        """Test an API outage in the real GPT client keeps the result out of the cache"""
+        client, services, gpt = detect_client
+        gpt_client = GPTVisionClient(api_key='test-key', max_retries=0)
+        gpt_client.async_client = Mock()
+        gpt_client.async_client.chat.completions.create = AsyncMock(side_effect=Exception("API Error"))
+        services[2] = gpt_client
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+        
+        assert response.status_code == 200
+        assert response.get_json()['data']['metadata']['yoloDetections'] == 2
+        assert len(ml_app.result_cache) == 0
+    
+    def test_services_initialized_on_first_request(self, sample_image, sample_yolo_detections):
+        """Test /ml/detect works without the Gunicorn preload (e.g. under flask run)"""
+        _, jpeg = cv2.imencode('.jpg', sample_image)
+        detector = Mock()
+        detector.detect_batch.side_effect = lambda images, dims: [sample_yolo_detections] * len(images)
+        
+        with patch.object(ml_app, 'image_preprocessor', None), \
+             patch.object(ml_app, 'yolo_detector', None), \
+             patch.object(ml_app, 'gpt_vision_client', None), \
+             patch.object(ml_app, 'ensemble_aggregator', None), \
+             patch.object(ml_app, 'inference_worker', None), \
+             patch.object(ml_app, 'YOLODetector', return_value=detector), \
+             patch.object(Config, 'OPENAI_API_KEY', None), \
+             patch.object(ImagePreprocessor, 'download_image', return_value=jpeg.tobytes()):
+            try:
+                response = ml_app.app.test_client().post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+                
+                assert response.status_code == 200
+                assert response.get_json()['data']['metadata']['yoloDetections'] == 2
+                assert ml_app.inference_worker is not None
+            finally:
+                if ml_app.inference_worker is not None:
+                    ml_app.inference_worker.stop(timeout=5)
+                ml_app.result_cache.clear()
+    
+    @patch.object(Config, 'GPT_CASCADE_CONFIDENCE', 0.8)
+    @patch.object(Config, 'GPT_CASCADE_MIN_DETECTIONS', 1)
+    def test_cascade_skips_gpt_when_yolo_is_conclusive(self, detect_client):
+        """Test GPT is never called when enough YOLO detections clear the cascade confidence"""
+        client, services, gpt = detect_client
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+        
+        data = response.get_json()['data']
+        assert response.status_code == 200
+        assert data['metadata']['yoloDetections'] == 2
+        assert data['metadata']['gptDetections'] == 0
+        gpt.submit.assert_not_called()
+        gpt.analyze_sync.assert_not_called()
+        services[0].preprocess.assert_called_once_with('http://example.com/a.jpg', include_gpt_payload=False)
+        assert len(ml_app.result_cache) == 1
+    
+    @patch.object(Config, 'GPT_CASCADE_CONFIDENCE', 0.8)
+    @patch.object(Config, 'GPT_CASCADE_MIN_DETECTIONS', 2)
+    def test_cascade_calls_gpt_when_yolo_is_inconclusive(self, detect_client, sample_gpt_detections):
+        """Test GPT runs after YOLO when too few detections clear the cascade confidence"""
+        client, services, gpt = detect_client
+        gpt.analyze_sync.return_value = sample_gpt_detections
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+        
+        assert response.status_code == 200
+        assert response.get_json()['data']['metadata']['gptDetections'] == 2
+        gpt.submit.assert_not_called()
+        gpt.analyze_sync.assert_called_once()
+
+
+# ============================================================================
+# Response Compression Tests
+# ============================================================================
+
+class TestResponseCompression:
+    """Test suite for gzip compression of JSON responses"""
+    
+    @pytest.fixture
+    def many_gpt_detections(self):
+        """GPT detections that survive aggregation, enough for a body over the gzip threshold"""
+        return [
+            {
+                'class': 'scratch',
+                'confidence': 0.9,
+                'bbox': {'x': 100 * (i % 6), 'y': 100 * (i // 6), 'width': 40, 'height': 40},
+                'source': 'gpt'
+            }
+            for i in range(30)
+        ]
+    
+    def test_large_json_is_gzipped(self, detect_client, many_gpt_detections):
+        """Test large JSON bodies are gzipped and marked to vary on Accept-Encoding"""
+        client, services, gpt = detect_client
+        gpt.submit.return_value = resolved(many_gpt_detections)
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'},
+                               headers={'Accept-Encoding': 'gzip, deflate'})
+        
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        body = json.loads(gzip.decompress(response.get_data()))
+        assert len(body['data']['defects']) > 30
+        assert len(response.get_data()) < len(json.dumps(body))
+    
+    def test_not_gzipped_without_accept_encoding(self, detect_client, many_gpt_detections):
+        """Test clients that do not accept gzip get the plain body"""
+        client, services, gpt = detect_client
+        gpt.submit.return_value = resolved(many_gpt_detections)
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg'})
+        
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_json()['success'] is True
+    
+    def test_small_body_not_gzipped(self, detect_client):
+        """Test bodies under RESPONSE_GZIP_MIN_SIZE are sent as-is"""
+        client, services, gpt = detect_client
+        
+        response = client.get('/health', headers={'Accept-Encoding': 'gzip'})
+        
+        assert len(response.get_data()) < Config.RESPONSE_GZIP_MIN_SIZE
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_json()['status'] == 'healthy'
+    
+    def test_streamed_response_not_gzipped(self, detect_client, many_gpt_detections):
+        """Test streamed NDJSON responses are not buffered for compression"""
+        client, services, gpt = detect_client
+        gpt.submit.return_value = resolved(many_gpt_detections)
+        
+        response = client.post('/ml/detect', json={'imageUrl': 'http://example.com/a.jpg', 'stream': True},
+                               headers={'Accept-Encoding': 'gzip'})
+        
+        assert response.mimetype == 'application/x-ndjson'
+        assert 'Content-Encoding' not in response.headers
+        stages = [json.loads(line)['stage'] for line in response.get_data().splitlines()]
+        assert stages == ['yolo', 'final']
+
+
+# ============================================================================
+# Dataset Preparation Tests
+# ============================================================================
+
+class TestLabelValidation:
+    """Test suite for YOLO label file validation"""
+    
+    def test_float_class_id_is_invalid(self, tmp_path):
+        """Test class IDs written as floats are rejected like the per-line parser does"""
+        from prepare_dataset import _validate_label_file
+        
+        label_file = tmp_path / 'image.txt'
+        label_file.write_text("1.0 0.5 0.5 0.1 0.1\n0 0.5 0.5 0.1 0.1\n1e0 0.5 0.5 0.1 0.1\n")
+        
+        total, valid, invalid, class_counts, errors = _validate_label_file(label_file, num_classes=12)
+        
+        assert (total, valid, invalid) == (3, 1, 2)
+        assert class_counts[0] == 1 and class_counts.sum() == 1
+        assert [error.split(' - ')[0] for error in errors] == ['image.txt:1', 'image.txt:3']
+    
+    def test_well_formed_file(self, tmp_path):
+        """Test a well-formed file is counted per class"""
+        from prepare_dataset import _validate_label_file
+        
+        label_file = tmp_path / 'image.txt'
+        label_file.write_text("0 0.5 0.5 0.1 0.1\n11 0.2 0.3 0.4 0.5\n11 0.2 0.3 0.4 1.5\n")
+        
+        total, valid, invalid, class_counts, errors = _validate_label_file(label_file, num_classes=12)
+        
+        assert (total, valid, invalid) == (3, 2, 1)
+        assert class_counts[0] == 1 and class_counts[11] == 1
+        assert errors == ['image.txt:3 - Coordinates out of range [0, 1]']
+
+
+# ============================================================================
+# Model Training Tests
+# ============================================================================
+
+class TestModelTrainer:
+    """Test suite for ModelTrainer"""
+    
+    @patch('torch.cuda.is_available', return_value=True)
+    def test_multi_gpu_trainer_importable_by_ddp_workers(self, mock_cuda, tmp_path, monkeypatch):
+        """Test DDP worker processes can import the trainer class by module path"""
+        from train_model import ModelTrainer
+        
+        monkeypatch.delenv('PYTHONPATH', raising=False)
+        launch_env = {}
+        model = MagicMock()
+        model.train.side_effect = lambda **kwargs: launch_env.update(os.environ)
+        trainer = ModelTrainer({'device': '0,1', 'cache': 'none', 'workers': 2})
+        
+        with patch.dict(sys.modules, {'utils.training': MagicMock(), 'psutil': MagicMock()}), \
+             patch('ultralytics.YOLO', return_value=model):
+            trainer.train('dataset.yaml')
+        
+        # Same lookup as the generated DDP script's import, run outside the service directory
+        result = subprocess.run(
+            [sys.executable, '-c',
+             'import importlib.util, sys; sys.exit(importlib.util.find_spec("utils.training") is None)'],
+            cwd=tmp_path, env=launch_env
+        )
+        
+        assert model.train.call_args.kwargs['device'] == [0, 1]
+        assert result.returncode == 0
 
 
 # ============================================================================
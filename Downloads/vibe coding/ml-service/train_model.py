@@ -6,16 +6,16 @@ Trains YOLOv8 model on aircraft defect detection dataset
 import os
 import sys
 import argparse
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import yaml
+import numpy as np
 
-from ultralytics import YOLO
-import torch
-from pymongo import MongoClient
-import boto3
-from botocore.exceptions import ClientError
+# ultralytics, torch, pymongo, boto3 and psutil are imported where they are used,
+# so --help and argument errors return without loading them
 
 from utils.logger import setup_logger
 from utils.config import Config
@@ -23,14 +23,17 @@ from utils.config import Config
 # Setup logger
 logger = setup_logger('model-training')
 
+# libyaml emitter when PyYAML was built with it
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
 
 class ModelTrainer:
     """
     YOLOv8 model trainer for aircraft defect detection
     """
     
-    # Defect class names (12 classes as per requirements)
-    CLASS_NAMES = [
+    # Defect class names (12 classes as per requirements), immutable
+    CLASS_NAMES = (
         'damaged_rivet',
         'missing_rivet',
         'filiform_corrosion',
@@ -43,7 +46,16 @@ class ModelTrainer:
         'scorch_mark',
         'metal_fatigue',
         'crack'
-    ]
+    )
+    
+    NUM_CLASSES = len(CLASS_NAMES)
+    CLASS_NAME_TO_IDX = {name: i for i, name in enumerate(CLASS_NAMES)}
+    
+    # Multipart part size for weight uploads; also used to predict the S3 ETag
+    S3_PART_SIZE = 16 * 1024 * 1024
+    
+    # Image extensions read by the Ultralytics dataloader
+    IMAGE_EXTENSIONS = ('.bmp', '.dng', '.jpeg', '.jpg', '.mpo', '.png', '.tif', '.tiff', '.webp', '.pfm')
     
     def __init__(self, config):
         """
@@ -55,23 +67,113 @@ class ModelTrainer:
         self.config = config
         self.model = None
         self.results = None
+        self.train_image_count = 0
         
         # MongoDB connection
         self.mongo_client = None
         self.db = None
         
-        # S3 client
+        # S3 client; storage settings are read once per run
         self.s3_client = None
+        self.use_local_storage = os.getenv('USE_LOCAL_STORAGE', 'true').lower() == 'true'
+        self.s3_bucket = os.getenv('AWS_S3_BUCKET')
+        self.transfer_config = None
         
         logger.info("ModelTrainer initialized")
     
+    @staticmethod
+    def parse_device(device):
+        """
+        Parse the training device setting
+        
+        A comma-separated list of GPU indices (e.g. "0,1,2,3") becomes a list
+        of ints, which makes Ultralytics launch DistributedDataParallel
+        training with one process per GPU.
+        
+        Args:
+            device: Device string such as cpu, cuda, 0 or 0,1,2,3
+            
+        Returns:
+            str or list: Device string, or list of GPU indices for multi-GPU
+        """
+        parts = [part.strip() for part in str(device).split(',') if part.strip()]
+        
+        if len(parts) > 1 and all(part.isdigit() for part in parts):
+            return [int(part) for part in parts]
+        
+        return str(device)
+    
+    def uses_cuda(self):
+        """
+        Check whether training runs on CUDA GPUs
+        
+        Returns:
+            bool: True unless the device is cpu/mps or no GPU is available
+        """
+        import torch
+        
+        device = str(self.config.get('device', 'cpu')).lower()
+        return device not in ('cpu', 'mps') and torch.cuda.is_available()
+    
+    def default_workers(self):
+        """
+        Pick a DataLoader worker count for this machine
+        
+        Four workers per GPU (or four on CPU), capped at the CPU count so
+        small instances are not oversubscribed.
+        
+        Returns:
+            int: Number of data loading workers
+        """
+        import torch
+        
+        num_gpus = torch.cuda.device_count() if self.uses_cuda() else 0
+        return max(1, min(os.cpu_count() or 8, 4 * max(1, num_gpus)))
+    
+    def resolve_cache(self):
+        """
+        Resolve the image cache mode for training
+        
+        'auto' caches decoded training images in RAM when they fit in 80%
+        of available memory, and disables caching otherwise.
+        
+        Returns:
+            str or bool: 'ram', 'disk' or False
+        """
+        import psutil
+        
+        cache = self.config.get('cache', 'auto')
+        
+        if cache != 'auto':
+            return cache if cache in ('ram', 'disk') else False
+        
+        # Ultralytics caches images resized to imgsz as uint8 BGR
+        image_size = self.config.get('image_size', 640)
+        required = self.train_image_count * image_size * image_size * 3
+        available = psutil.virtual_memory().available
+        
+        if 0 < required < 0.8 * available:
+            logger.info(f"Caching training images in RAM ({required / 1e9:.1f} GB of {available / 1e9:.1f} GB available)")
+            return 'ram'
+        
+        return False
+    
     def connect_mongodb(self):
         """Connect to MongoDB database"""
+        from pymongo import MongoClient
+        
         try:
             mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/aircraft_detection')
             logger.info(f"Connecting to MongoDB: {mongodb_uri}")
             
-            self.mongo_client = MongoClient(mongodb_uri)
+            # zlib is in the stdlib, so wire compression needs no extra package
+            self.mongo_client = MongoClient(
+                mongodb_uri,
+                compressors='zlib',
+                retryWrites=True,
+                w='majority',
+                socketTimeoutMS=20000
+            )
             db_name = mongodb_uri.split('/')[-1].split('?')[0]
             self.db = self.mongo_client[db_name]
             
@@ -86,9 +188,7 @@ class ModelTrainer:
     def connect_s3(self):
         """Connect to AWS S3"""
         try:
-            use_local_storage = os.getenv('USE_LOCAL_STORAGE', 'true').lower() == 'true'
-            
-            if use_local_storage:
+            if self.use_local_storage:
                 logger.info("Using local storage (S3 disabled)")
                 return
             
@@ -100,12 +200,21 @@ class ModelTrainer:
                 logger.warning("AWS credentials not configured, using local storage")
                 return
             
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            
             self.s3_client = boto3.client(
                 's3',
                 aws_access_key_id=aws_access_key,
                 aws_secret_access_key=aws_secret_key,
                 region_name=aws_region
             )
+            self.transfer_config = TransferConfig(
+                multipart_threshold=self.S3_PART_SIZE,
+                multipart_chunksize=self.S3_PART_SIZE,
+                max_concurrency=10,
+                use_threads=True
+            )
             
             logger.info("S3 client initialized")
             
@@ -113,6 +222,24 @@ class ModelTrainer:
             logger.error(f"S3 connection failed: {str(e)}")
             logger.warning("Falling back to local storage")
     
+    @classmethod
+    def count_images(cls, dir_path):
+        """
+        Count image files in a directory
+        
+        Uses os.scandir, whose entries carry the file type from the directory
+        listing, so no Path objects or per-file stat calls are needed.
+        
+        Args:
+            dir_path: Directory to scan
+            
+        Returns:
+            int: Number of image files
+        """
+        with os.scandir(dir_path) as entries:
+            return sum(1 for entry in entries
+                       if entry.name.lower().endswith(cls.IMAGE_EXTENSIONS) and entry.is_file())
+    
     def prepare_dataset(self, dataset_path):
         """
         Prepare and validate dataset for training
@@ -135,20 +262,21 @@ class ModelTrainer:
                 raise ValueError(f"Required directory not found: {dir_path}")
         
         # Count images
-        train_images = list((dataset_path / 'train/images').glob('*'))
-        val_images = list((dataset_path / 'val/images').glob('*'))
+        train_images = self.count_images(dataset_path / 'train/images')
+        val_images = self.count_images(dataset_path / 'val/images')
         
-        total_images = len(train_images) + len(val_images)
-        train_split = len(train_images) / total_images if total_images > 0 else 0
-        val_split = len(val_images) / total_images if total_images > 0 else 0
+        self.train_image_count = train_images
+        total_images = train_images + val_images
+        train_split = train_images / total_images if total_images > 0 else 0
+        val_split = val_images / total_images if total_images > 0 else 0
         
         dataset_info = {
             'totalImages': total_images,
-            'trainImages': len(train_images),
-            'valImages': len(val_images),
+            'trainImages': train_images,
+            'valImages': val_images,
             'trainSplit': round(train_split, 2),
             'valSplit': round(val_split, 2),
-            'classes': self.CLASS_NAMES
+            'classes': list(self.CLASS_NAMES)
         }
         
         logger.info(f"Dataset prepared: {dataset_info}")
@@ -169,13 +297,13 @@ class ModelTrainer:
             'path': str(dataset_path),
             'train': 'train/images',
             'val': 'val/images',
-            'nc': len(self.CLASS_NAMES),
-            'names': self.CLASS_NAMES
+            'nc': self.NUM_CLASSES,
+            'names': list(self.CLASS_NAMES)
         }
         
         output_path = Path(output_path)
         with open(output_path, 'w') as f:
-            yaml.dump(dataset_config, f, default_flow_style=False)
+            yaml.dump(dataset_config, f, Dumper=YAML_DUMPER, default_flow_style=False)
         
         logger.info(f"Dataset YAML created: {output_path}")
         
@@ -191,6 +319,10 @@ class ModelTrainer:
         Returns:
             dict: Training results
         """
+        import torch
+        from ultralytics import YOLO
+        from utils.training import CudaDetectionTrainer
+        
         logger.info("=" * 60)
         logger.info("Starting YOLOv8 Training")
         logger.info("=" * 60)
@@ -200,6 +332,12 @@ class ModelTrainer:
         for key, value in self.config.items():
             logger.info(f"  {key}: {value}")
         
+        use_cuda = self.uses_cuda()
+        
+        # Fixed imgsz, so let cuDNN autotune conv algorithms once
+        if use_cuda:
+            torch.backends.cudnn.benchmark = True
+        
         # Initialize model
         base_model = self.config.get('base_model', 'yolov8n.pt')
         logger.info(f"Loading base model: {base_model}")
@@ -212,18 +350,30 @@ class ModelTrainer:
             'batch': self.config.get('batch_size', 16),
             'imgsz': self.config.get('image_size', 640),
             'lr0': self.config.get('learning_rate', 0.01),
-            'device': self.config.get('device', 'cpu'),
+            'device': self.parse_device(self.config.get('device', 'cpu')),
             'project': self.config.get('project_dir', 'runs/train'),
             'name': self.config.get('run_name', 'aircraft_defect'),
             'exist_ok': True,
             'patience': self.config.get('patience', 50),
             'save': True,
             'save_period': self.config.get('save_period', 10),
-            'cache': False,
-            'workers': self.config.get('workers', 8),
+            'cache': self.resolve_cache(),
+            'workers': self.config.get('workers') or self.default_workers(),
+            'amp': True,
             'verbose': True,
         }
         
+        # Ultralytics accumulates gradients up to the nominal batch size (nbs);
+        # by default nbs=64, i.e. round(64 / batch) steps per optimizer update
+        accumulate = self.config.get('accumulate')
+        if accumulate:
+            train_params['nbs'] = train_params['batch'] * accumulate
+            logger.info(f"Gradient accumulation: {accumulate} steps, effective batch {train_params['nbs']}")
+        
+        # Deterministic mode would override the cuDNN autotuner
+        if use_cuda:
+            train_params['deterministic'] = False
+        
         # Data augmentation settings
         if self.config.get('augmentation', True):
             train_params.update({
@@ -243,10 +393,23 @@ class ModelTrainer:
         
         logger.info("Starting training...")
         logger.info(f"Training on device: {train_params['device']}")
+        if isinstance(train_params['device'], list):
+            logger.info(f"Multi-GPU DDP training across {len(train_params['device'])} GPUs")
         
         # Train model
         try:
-            self.results = self.model.train(**train_params)
+            # Channels-last model and fused Adam/AdamW on GPU; plain DetectionTrainer elsewhere
+            trainer_cls = CudaDetectionTrainer if use_cuda else None
+            
+            # DDP workers run a script Ultralytics generates in its own config
+            # directory, which imports the trainer by module path (utils.training)
+            if trainer_cls is not None and isinstance(train_params['device'], list):
+                service_dir = os.path.dirname(os.path.abspath(__file__))
+                pythonpath = os.environ.get('PYTHONPATH', '')
+                if service_dir not in pythonpath.split(os.pathsep):
+                    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [service_dir, pythonpath]))
+            
+            self.results = self.model.train(trainer=trainer_cls, **train_params)
             logger.info("Training completed successfully")
             
         except Exception as e:
@@ -270,39 +433,49 @@ class ModelTrainer:
             raise ValueError("Model not trained yet")
         
         try:
-            # Run validation
-            val_results = self.model.val()
+            # Run validation (FP16 on GPU)
+            val_results = self.model.val(half=self.uses_cuda())
+            
+            # Read mean precision/recall once; F1 reuses them
+            box = val_results.box
+            precision = float(box.mp)
+            recall = float(box.mr)
+            f1_score = 2 * precision * recall / (precision + recall) if precision + recall > 1e-12 else 0.0
             
             # Extract metrics
             metrics = {
-                'mAP': float(val_results.box.map),  # mAP@0.5:0.95
-                'mAP50': float(val_results.box.map50),  # mAP@0.5
-                'mAP75': float(val_results.box.map75),  # mAP@0.75
-                'precision': float(val_results.box.mp),
-                'recall': float(val_results.box.mr),
-                'f1Score': float(2 * val_results.box.mp * val_results.box.mr / (val_results.box.mp + val_results.box.mr)) if (val_results.box.mp + val_results.box.mr) > 0 else 0.0
+                'mAP': float(box.map),  # mAP@0.5:0.95
+                'mAP50': float(box.map50),  # mAP@0.5
+                'mAP75': float(box.map75),  # mAP@0.75
+                'precision': precision,
+                'recall': recall,
+                'f1Score': f1_score
             }
             
-            # Per-class metrics
-            class_metrics = []
-            if hasattr(val_results.box, 'maps') and val_results.box.maps is not None:
-                for i, class_name in enumerate(self.CLASS_NAMES):
-                    if i < len(val_results.box.maps):
-                        class_metrics.append({
-                            'class': class_name,
-                            'ap': float(val_results.box.maps[i]),
-                            'precision': float(val_results.box.p[i]) if hasattr(val_results.box, 'p') and i < len(val_results.box.p) else 0.0,
-                            'recall': float(val_results.box.r[i]) if hasattr(val_results.box, 'r') and i < len(val_results.box.r) else 0.0
-                        })
+            # Per-class metrics, each array converted to Python floats in one call
+            maps = getattr(box, 'maps', None)
+            maps = np.asarray(maps, dtype=np.float64).tolist() if maps is not None else []
+            precisions = np.asarray(getattr(box, 'p', []), dtype=np.float64).tolist()
+            recalls = np.asarray(getattr(box, 'r', []), dtype=np.float64).tolist()
+            
+            class_metrics = [
+                {
+                    'class': class_name,
+                    'ap': maps[i],
+                    'precision': precisions[i] if i < len(precisions) else 0.0,
+                    'recall': recalls[i] if i < len(recalls) else 0.0
+                }
+                for i, class_name in enumerate(self.CLASS_NAMES[:len(maps)])
+            ]
             
             metrics['classMetrics'] = class_metrics
             
             logger.info("Validation Metrics:")
             logger.info(f"  mAP@0.5:0.95: {metrics['mAP']:.4f}")
             logger.info(f"  mAP@0.5: {metrics['mAP50']:.4f}")
-            logger.info(f"  Precision: {metrics['precision']:.4f}")
-            logger.info(f"  Recall: {metrics['recall']:.4f}")
-            logger.info(f"  F1 Score: {metrics['f1Score']:.4f}")
+            logger.info(f"  Precision: {precision:.4f}")
+            logger.info(f"  Recall: {recall:.4f}")
+            logger.info(f"  F1 Score: {f1_score:.4f}")
             
             # Check if model meets deployment criteria (mAP >= 0.95)
             if metrics['mAP50'] >= 0.95:
@@ -326,6 +499,8 @@ class ModelTrainer:
         Returns:
             str: Path to saved weights
         """
+        from ultralytics.utils.torch_utils import strip_optimizer
+        
         if self.model is None:
             raise ValueError("Model not trained yet")
         
@@ -333,14 +508,14 @@ class ModelTrainer:
             # Get best weights from training
             best_weights = Path(self.model.trainer.best)
             
-            # Copy to output path
+            # Write an inference-only checkpoint: FP16 weights, no optimizer/EMA state
             output_path = Path(output_path)
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            import shutil
-            shutil.copy(best_weights, output_path)
+            strip_optimizer(str(best_weights), str(output_path))
             
-            logger.info(f"Model weights saved: {output_path}")
+            size_mb = output_path.stat().st_size / 1e6
+            logger.info(f"Model weights saved: {output_path} ({size_mb:.1f} MB)")
             
             return str(output_path)
             
@@ -348,6 +523,53 @@ class ModelTrainer:
             logger.error(f"Failed to save weights: {str(e)}")
             raise
     
+    @classmethod
+    def s3_etag(cls, local_path):
+        """
+        Compute the ETag S3 assigns to a file uploaded with transfer_config
+        
+        Single-part uploads get the file's MD5; multipart uploads get the MD5
+        of the concatenated part digests followed by the part count.
+        
+        Args:
+            local_path: Local file path
+            
+        Returns:
+            str: Expected ETag without quotes
+        """
+        with open(local_path, 'rb') as f:
+            part_digests = [hashlib.md5(part).digest() for part in iter(lambda: f.read(cls.S3_PART_SIZE), b'')]
+        
+        # boto3 switches to multipart at multipart_threshold (== part size)
+        if os.path.getsize(local_path) < cls.S3_PART_SIZE:
+            return part_digests[0].hex() if part_digests else hashlib.md5(b'').hexdigest()
+        
+        return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+    
+    def s3_object_matches(self, bucket_name, s3_key, local_path):
+        """
+        Check whether S3 already holds an identical copy of a local file
+        
+        Args:
+            bucket_name: S3 bucket
+            s3_key: S3 object key
+            local_path: Local file path
+            
+        Returns:
+            bool: True if the object exists with the same size and ETag
+        """
+        from botocore.exceptions import ClientError
+        
+        try:
+            head = self.s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+        except ClientError:
+            return False
+        
+        if head.get('ContentLength') != os.path.getsize(local_path):
+            return False
+        
+        return head.get('ETag', '').strip('"') == self.s3_etag(local_path)
+    
     def upload_to_s3(self, local_path, s3_key):
         """
         Upload model weights to S3
@@ -359,29 +581,36 @@ class ModelTrainer:
         Returns:
             str: S3 URL or local path
         """
-        use_local_storage = os.getenv('USE_LOCAL_STORAGE', 'true').lower() == 'true'
-        
-        if use_local_storage or self.s3_client is None:
+        if self.use_local_storage or self.s3_client is None:
             logger.info(f"Using local storage: {local_path}")
             return f"file://{os.path.abspath(local_path)}"
         
+        from botocore.exceptions import ClientError
+        
         try:
-            bucket_name = os.getenv('AWS_S3_BUCKET')
+            bucket_name = self.s3_bucket
             
             if not bucket_name:
                 logger.warning("S3 bucket not configured, using local storage")
                 return f"file://{os.path.abspath(local_path)}"
             
-            logger.info(f"Uploading to S3: s3://{bucket_name}/{s3_key}")
+            s3_url = f"s3://{bucket_name}/{s3_key}"
             
+            if self.s3_object_matches(bucket_name, s3_key, local_path):
+                logger.info(f"Identical object already in S3, skipping upload: {s3_url}")
+                return s3_url
+            
+            logger.info(f"Uploading to S3: {s3_url}")
+            
+            # Parallel multipart upload for large weight files
             self.s3_client.upload_file(
                 local_path,
                 bucket_name,
                 s3_key,
-                ExtraArgs={'ContentType': 'application/octet-stream'}
+                ExtraArgs={'ContentType': 'application/octet-stream'},
+                Config=self.transfer_config
             )
             
-            s3_url = f"s3://{bucket_name}/{s3_key}"
             logger.info(f"Upload successful: {s3_url}")
             
             return s3_url
@@ -477,12 +706,15 @@ def parse_arguments():
                         help='Number of training epochs (default: 100)')
     parser.add_argument('--batch-size', type=int, default=16,
                         help='Batch size (default: 16)')
+    parser.add_argument('--accumulate', type=int, default=None,
+                        help='Batches to accumulate per optimizer step (default: Ultralytics, up to a batch of 64)')
     parser.add_argument('--learning-rate', type=float, default=0.01,
                         help='Initial learning rate (default: 0.01)')
     parser.add_argument('--image-size', type=int, default=640,
                         help='Image size for training (default: 640)')
     parser.add_argument('--device', type=str, default='cpu',
-                        help='Device for training: cpu, cuda, mps (default: cpu)')
+                        help='Device for training: cpu, cuda, mps, or GPU indices like 0,1,2,3 '
+                             'for multi-GPU DDP (default: cpu)')
     
     # Model configuration
     parser.add_argument('--base-model', type=str, default='yolov8n.pt',
@@ -501,8 +733,10 @@ def parse_arguments():
     # Optional
     parser.add_argument('--created-by', type=str, default=None,
                         help='User ID who initiated training')
-    parser.add_argument('--workers', type=int, default=8,
-                        help='Number of data loading workers (default: 8)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of data loading workers (default: 4 per GPU, capped at CPU count)')
+    parser.add_argument('--cache', type=str, default='auto', choices=['auto', 'ram', 'disk', 'none'],
+                        help='Image cache: auto (RAM if it fits), ram, disk or none (default: auto)')
     parser.add_argument('--patience', type=int, default=50,
                         help='Early stopping patience (default: 50)')
     parser.add_argument('--save-period', type=int, default=10,
@@ -525,6 +759,7 @@ def main():
         config = {
             'epochs': args.epochs,
             'batch_size': args.batch_size,
+            'accumulate': args.accumulate,
             'learning_rate': args.learning_rate,
             'image_size': args.image_size,
             'device': args.device,
@@ -533,6 +768,7 @@ def main():
             'project_dir': args.project_dir,
             'run_name': args.run_name,
             'workers': args.workers,
+            'cache': args.cache,
             'patience': args.patience,
             'save_period': args.save_period
         }
@@ -540,12 +776,21 @@ def main():
         # Initialize trainer
         trainer = ModelTrainer(config)
         
-        # Connect to services
-        trainer.connect_mongodb()
-        trainer.connect_s3()
+        # Under torchrun every rank runs this script; only rank 0 publishes results
+        is_main_process = int(os.getenv('RANK', '-1')) in (-1, 0)
         
-        # Prepare dataset
-        dataset_info = trainer.prepare_dataset(args.dataset)
+        # Connect to services and scan the dataset concurrently; all three are I/O-bound
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            connections = []
+            if is_main_process:
+                connections.append(executor.submit(trainer.connect_mongodb))
+                connections.append(executor.submit(trainer.connect_s3))
+            dataset_future = executor.submit(trainer.prepare_dataset, args.dataset)
+            
+            # result() re-raises any connection or dataset error
+            for future in connections:
+                future.result()
+            dataset_info = dataset_future.result()
         
         # Create dataset YAML
         dataset_yaml = trainer.create_dataset_yaml(args.dataset)
@@ -553,6 +798,10 @@ def main():
         # Train model
         trainer.train(dataset_yaml)
         
+        if not is_main_process:
+            logger.info(f"Rank {os.getenv('RANK')} finished training, skipping upload")
+            return 0
+        
         # Validate model
         metrics = trainer.validate()
         
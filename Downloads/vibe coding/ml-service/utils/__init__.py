@@ -3,4 +3,10 @@ Utilities Package
 Contains utility functions and helper classes
 """
 
-__all__ = []
+from .result_cache import ResultCache
+from .buffer_pool import BufferPool
+
+__all__ = [
+    'ResultCache',
+    'BufferPool'
+]
@@ -0,0 +1,59 @@
+"""
+Asyncio helpers for ML service
+Runs a single background event loop shared by all request threads
+"""
+
+import asyncio
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Get the background event loop, starting its thread on first use
+
+    Returns:
+        asyncio.AbstractEventLoop: Loop running forever on a daemon thread
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='ml-aio', daemon=True)
+            thread.start()
+            _loop = loop
+
+    return _loop
+
+
+def submit(coro):
+    """
+    Schedule a coroutine on the background loop from any thread
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        concurrent.futures.Future: Resolves to the coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_sync(coro, timeout=None):
+    """
+    Run a coroutine on the background loop and block for its result
+
+    Args:
+        coro: Coroutine to run
+        timeout: Seconds to wait for the result (optional)
+
+    Returns:
+        Result of the coroutine
+
+    Raises:
+        concurrent.futures.TimeoutError: If the result is not ready in time
+    """
+    return submit(coro).result(timeout)
@@ -0,0 +1,72 @@
+"""
+Buffer pool for ML service
+Reusable preallocated NumPy arrays for fixed-size image buffers
+"""
+
+import threading
+import numpy as np
+
+
+class BufferPool:
+    """
+    Thread-safe pool of same-shaped NumPy arrays
+
+    Buffers are allocated up front and handed out on acquire(); when the
+    pool is empty a fresh array is allocated instead of blocking, so the
+    pool caps steady-state allocations without limiting concurrency.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, size=16):
+        """
+        Initialize buffer pool
+
+        Args:
+            shape: Shape of every buffer, e.g. (640, 640, 3)
+            dtype: NumPy dtype of every buffer (default: uint8)
+            size: Number of buffers kept in the pool (default: 16)
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self._free = [np.empty(self.shape, dtype=self.dtype) for _ in range(size)]
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a buffer from the pool
+
+        Returns:
+            numpy.ndarray: Uninitialized buffer of the pool's shape and dtype
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def release(self, buffer):
+        """
+        Return a buffer to the pool
+
+        Buffers of the wrong shape or dtype, or beyond the pool size, are
+        dropped and left to the garbage collector.
+
+        Args:
+            buffer: Array previously returned by acquire()
+        """
+        if buffer is None or buffer.shape != self.shape or buffer.dtype != self.dtype:
+            return
+
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(buffer)
+
+    def available(self):
+        """
+        Number of buffers currently in the pool
+
+        Returns:
+            int: Free buffer count
+        """
+        with self._lock:
+            return len(self._free)
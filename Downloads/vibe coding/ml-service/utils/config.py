@@ -20,10 +20,20 @@ class Config:
     # YOLO Configuration
     YOLO_MODEL_PATH = os.getenv('YOLO_MODEL_PATH', 'models/yolov8_latest.pt')
     YOLO_CONFIDENCE_THRESHOLD = float(os.getenv('YOLO_CONFIDENCE_THRESHOLD', '0.5'))
+    YOLO_PRECISION = os.getenv('YOLO_PRECISION', 'fp16')
+    YOLO_ENGINE_PATH = os.getenv('YOLO_ENGINE_PATH', '')
+    YOLO_TORCH_COMPILE = os.getenv('YOLO_TORCH_COMPILE', 'false').lower() == 'true'
+    YOLO_MAX_BATCH_SIZE = int(os.getenv('YOLO_MAX_BATCH_SIZE', '8'))
+    YOLO_BATCH_WAIT_MS = int(os.getenv('YOLO_BATCH_WAIT_MS', '10'))
     
     # GPT Vision Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     GPT_VISION_MODEL = os.getenv('GPT_VISION_MODEL', 'gpt-4-vision-preview')
+    # Skip GPT when YOLO finds at least this many detections above the
+    # cascade confidence (0 disables the cascade)
+    GPT_CASCADE_MIN_DETECTIONS = int(os.getenv('GPT_CASCADE_MIN_DETECTIONS', '0'))
+    GPT_CASCADE_CONFIDENCE = float(os.getenv('GPT_CASCADE_CONFIDENCE', '0.9'))
+    GPT_PASSTHROUGH_MAX_BYTES = int(os.getenv('GPT_PASSTHROUGH_MAX_BYTES', str(2 * 1024 * 1024)))
     
     # Ensemble Configuration
     ENSEMBLE_YOLO_WEIGHT = float(os.getenv('ENSEMBLE_YOLO_WEIGHT', '0.6'))
@@ -32,6 +42,19 @@ class Config:
     # Image Processing Configuration
     MAX_IMAGE_SIZE = int(os.getenv('MAX_IMAGE_SIZE', '4096'))
     MIN_IMAGE_SIZE = int(os.getenv('MIN_IMAGE_SIZE', '640'))
+    MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(50 * 1024 * 1024)))
+    
+    # Concurrency Configuration
+    INFERENCE_POOL_WORKERS = int(os.getenv('INFERENCE_POOL_WORKERS', '16'))
+    PREPROCESS_BUFFER_POOL_SIZE = int(os.getenv('PREPROCESS_BUFFER_POOL_SIZE', '16'))
+    
+    # Result Cache Configuration
+    RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '4096'))
+    RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '3600'))
+    
+    # Response Compression Configuration
+    RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', '4'))
+    RESPONSE_GZIP_MIN_SIZE = int(os.getenv('RESPONSE_GZIP_MIN_SIZE', '1024'))
     
     @classmethod
     def validate(cls):
@@ -6,11 +6,17 @@ import logging
 import sys
 from datetime import datetime
 
+# Loggers already configured by setup_logger, keyed by name
+_configured = {}
+
 
 def setup_logger(name='ml-service', level=logging.INFO):
     """
     Set up and configure logger
     
+    Handlers are attached once per name; repeated calls (re-imports, tests)
+    only update the level and return the same logger.
+    
     Args:
         name: Logger name
         level: Logging level
@@ -18,6 +24,13 @@ def setup_logger(name='ml-service', level=logging.INFO):
     Returns:
         Configured logger instance
     """
+    logger = _configured.get(name)
+    if logger is not None:
+        logger.setLevel(level)
+        for handler in logger.handlers:
+            handler.setLevel(level)
+        return logger
+    
     logger = logging.getLogger(name)
     logger.setLevel(level)
     
@@ -37,6 +50,7 @@ def setup_logger(name='ml-service', level=logging.INFO):
     
     # Add handler to logger
     logger.addHandler(console_handler)
+    _configured[name] = logger
     
     return logger
 
@@ -51,9 +65,10 @@ def log_request(logger, endpoint, method, data=None):
         method: HTTP method
         data: Request data (optional)
     """
-    logger.info(f"Request: {method} {endpoint}")
+    # %-style arguments so nothing is formatted when INFO is filtered out
+    logger.info("Request: %s %s", method, endpoint)
     if data:
-        logger.debug(f"Request data: {data}")
+        logger.debug("Request data: %s", data)
 
 
 def log_response(logger, endpoint, status_code, processing_time=None):
@@ -66,10 +81,10 @@ def log_response(logger, endpoint, status_code, processing_time=None):
         status_code: HTTP status code
         processing_time: Processing time in seconds (optional)
     """
-    message = f"Response: {endpoint} - Status: {status_code}"
     if processing_time:
-        message += f" - Time: {processing_time:.2f}s"
-    logger.info(message)
+        logger.info("Response: %s - Status: %s - Time: %.2fs", endpoint, status_code, processing_time)
+    else:
+        logger.info("Response: %s - Status: %s", endpoint, status_code)
 
 
 def log_error(logger, error, context=None):
@@ -81,7 +96,7 @@ def log_error(logger, error, context=None):
         error: Error object or message
         context: Additional context (optional)
     """
-    error_msg = f"Error: {str(error)}"
     if context:
-        error_msg += f" - Context: {context}"
-    logger.error(error_msg, exc_info=True)
+        logger.error("Error: %s - Context: %s", error, context, exc_info=True)
+    else:
+        logger.error("Error: %s", error, exc_info=True)
@@ -0,0 +1,93 @@
+"""
+Result cache for ML service
+Thread-safe LRU cache with per-entry expiry for detection results
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU cache with a time-to-live, shared by all request threads
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600):
+        """
+        Initialize result cache
+
+        Args:
+            maxsize: Maximum number of cached entries (0 disables the cache)
+            ttl: Seconds an entry stays valid (default: 3600)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_url, fingerprint):
+        """
+        Build a compact cache key from an image URL and model fingerprint
+
+        Args:
+            image_url: URL of the analyzed image
+            fingerprint: String identifying the model configuration
+
+        Returns:
+            str: 32-character hex digest
+        """
+        payload = f"{image_url}\x00{fingerprint}".encode('utf-8')
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached value, refreshing its LRU position
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value, or None on miss or expiry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entry when full
+
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,64 @@
+"""
+Training helpers for YOLOv8
+Ultralytics trainer extensions used by train_model.py
+
+Kept in an importable module (not train_model.py) so Ultralytics can
+re-import the trainer class in its DDP worker processes. Those run a
+generated script outside this directory, so train_model.py adds the
+service directory to PYTHONPATH before multi-GPU training.
+"""
+
+import torch
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+
+class CudaDetectionTrainer(DetectionTrainer):
+    """
+    Detection trainer tuned for CUDA GPUs
+
+    Builds the model in channels-last (NHWC) memory format, which lets
+    cuDNN pick tensor-core convolution kernels under AMP, and uses
+    PyTorch's fused Adam/AdamW kernels, which update all parameters of a
+    group in a single CUDA kernel instead of several small kernels per
+    tensor. Both live in the trainer so DDP worker processes, which
+    rebuild the trainer from its class, get them too.
+    """
+
+    FUSED_OPTIMIZERS = (torch.optim.Adam, torch.optim.AdamW)
+
+    def get_model(self, *args, **kwargs):
+        """
+        Build the detection model in channels-last memory format
+
+        Runs before the trainer moves the model to its device and creates
+        the EMA copy, optimizer and DDP wrapper, which all keep the format.
+
+        Returns:
+            DetectionModel: Model with NHWC weights
+        """
+        return super().get_model(*args, **kwargs).to(memory_format=torch.channels_last)
+
+    def build_optimizer(self, *args, **kwargs):
+        """
+        Build the optimizer Ultralytics selects, switching Adam/AdamW to fused
+
+        SGD and other optimizers, and models not on CUDA, are returned as built.
+
+        Returns:
+            torch.optim.Optimizer: Optimizer over the model's parameter groups
+        """
+        optimizer = super().build_optimizer(*args, **kwargs)
+
+        if type(optimizer) not in self.FUSED_OPTIMIZERS:
+            return optimizer
+
+        if not all(p.is_cuda for group in optimizer.param_groups for p in group['params']):
+            return optimizer
+
+        # Drop per-group implementation flags so they don't override fused=True
+        param_groups = [
+            {key: value for key, value in group.items() if key not in ('fused', 'foreach')}
+            for group in optimizer.param_groups
+        ]
+
+        return type(optimizer)(param_groups, fused=True)